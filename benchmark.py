@@ -0,0 +1,159 @@
+"""
+Times the core operations of decision_tree on random trees of several sizes.
+
+    python benchmark.py --sizes 1000 10000 100000 --out bench.json
+    python benchmark.py --compare old.json new.json
+
+Every operation is timed --repeat times and the fastest run is kept.  Peak
+memory is measured in a separate run with tracemalloc, since tracing slows
+the code down.  Results are saved as JSON so two runs can be compared.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import decision_tree as dt
+
+
+def setup(size, args):
+    """Makes the tree and the files used by the timed operations"""
+    tree = dt.random_tree(size, args.branching, args.max_depth, args.decision_share,
+                          args.skew, args.seed)
+    directory = tempfile.mkdtemp()
+    text_file = os.path.join(directory, 'tree.txt')
+    dt.write_tree(tree, text_file)
+    strategy, tree = dt.solve(dt.load_tree(text_file))
+    return {'tree': tree, 'strategy': strategy, 'text_file': text_file,
+            'out_file': os.path.join(directory, 'out.txt')}
+
+
+def operations(state, trials):
+    """ The operations to time
+
+        return: list of (name, function, amount of work, unit of work, prepare).
+                prepare is None or a function run before every call, outside
+                the timing, whose result is passed to function
+    """
+    tree = state['tree']
+    strategy = state['strategy']
+    n = len(tree)
+
+    def quiet(function, *args):
+        with contextlib.redirect_stdout(io.StringIO()):
+            function(*args)
+
+    def play_trials():
+        for k in range(trials):
+            dt.play(strategy, tree)
+
+    ops = [
+        ('load', lambda: dt.load_tree(state['text_file']), n, 'nodes'),
+        ('load_compact', lambda: dt.load_tree(state['text_file'], compact=True), n, 'nodes'),
+        ('save_tree', lambda: dt.write_tree(tree, state['out_file']), n, 'nodes'),
+        ('solve', dt.solve, n, 'nodes', lambda: dt.load_tree(state['text_file'])),
+        ('solve_indexed', lambda: dt.solve(tree), n, 'nodes'),
+        ('calc_values', lambda: dt.calc_values(strategy, tree), n, 'nodes'),
+        ('compiled_solve', dt.CompiledTree.solve, n, 'nodes', lambda: dt.compile_tree(tree)),
+        ('play', play_trials, trials, 'trials'),
+        ('sim_decisions', lambda: quiet(dt.sim_decisions, trials, tree, strategy), trials, 'trials'),
+        ('show', lambda: dt.show(tree, file=io.StringIO()), n, 'nodes'),
+        ('see', lambda: dt.show_computed_values(tree, file=io.StringIO()), n, 'nodes'),
+        ('path', lambda: dt.path(strategy, tree, file=io.StringIO()), n, 'nodes'),
+        ('solve_mcts', lambda: dt.solve_mcts(tree, trials, rollouts=0, seed=1), trials, 'samples'),
+    ]
+    ops = [op if len(op) == 5 else op + (None,) for op in ops]
+    if dt.np is not None:
+        ops.append(('sim_batched', lambda: quiet(dt.sim_decisions, trials, tree, strategy,
+                                                 dt.SIM_BATCH_SIZE), trials, 'trials', None))
+    return ops
+
+
+def run(args):
+    """Runs the benchmark and returns the results as a dictionary"""
+    results = []
+    for size in args.sizes:
+        state = setup(size, args)
+        for name, function, work, unit, prepare in operations(state, args.trials):
+            if args.only and name not in args.only:
+                continue
+            best = None
+            for k in range(args.repeat):
+                if prepare is not None:
+                    argument = prepare()
+                    start = time.perf_counter()
+                    function(argument)
+                else:
+                    start = time.perf_counter()
+                    function()
+                seconds = time.perf_counter() - start
+                best = seconds if best is None else min(best, seconds)
+            peak = None
+            if args.memory:
+                argument = prepare() if prepare is not None else None
+                tracemalloc.start()
+                function() if prepare is None else function(argument)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            result = {'op': name, 'size': len(state['tree']), 'seconds': best,
+                      'rate': work / best if best > 0 else None, 'unit': unit,
+                      'peak_bytes': peak}
+            results.append(result)
+            print('{:>16} {:>9} nodes {:>10.4f} s {:>14,.0f} {}/s {:>14} bytes'.format(
+                name, result['size'], best, result['rate'] or 0, unit,
+                '-' if peak is None else '{:,}'.format(peak)))
+    return {'python': platform.python_version(), 'numpy': dt.np is not None,
+            'settings': {key: value for key, value in vars(args).items()
+                         if key not in ('out', 'compare')},
+            'results': results}
+
+
+def compare(old_name, new_name):
+    """Prints how much faster (ratio > 1) or slower each operation got"""
+    with open(old_name) as file:
+        old = {(r['op'], r['size']): r for r in json.load(file)['results']}
+    with open(new_name) as file:
+        new = json.load(file)['results']
+    print('{:>16} {:>9} {:>12} {:>12} {:>8}'.format('op', 'size', 'old s', 'new s', 'speedup'))
+    for r in new:
+        before = old.get((r['op'], r['size']))
+        if before is None:
+            continue
+        print('{:>16} {:>9} {:>12.4f} {:>12.4f} {:>8.2f}'.format(
+            r['op'], r['size'], before['seconds'], r['seconds'], before['seconds'] / r['seconds']))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Benchmark decision_tree operations.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--branching', type=int, default=3)
+    parser.add_argument('--max-depth', type=int, default=None)
+    parser.add_argument('--decision-share', type=float, default=0.5)
+    parser.add_argument('--skew', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--trials', type=int, default=100000, help='plays for play and sim')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--memory', action=argparse.BooleanOptionalAction, default=True,
+                        help='also measure peak memory with tracemalloc')
+    parser.add_argument('--only', nargs='+', help='names of the operations to run')
+    parser.add_argument('--out', help='JSON file to save the results in')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two saved result files instead of running')
+    args = parser.parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+    results = run(args)
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump(results, file, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,26 @@
+import argparse
+import bisect
+import csv
+import glob
+import hashlib
+import io
+import json
+import math
+import mmap
+import os
 import random
+import statistics
+import struct
+import sys
+import time
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for the batched simulation
+    np = None
 
 """
 A tree is represented as a list of dictionaries.
@@ -22,10 +44,19 @@ if the value of 'type' equals 'n'
 
     'descendants': list (of node indexes that this node branches to)
     'probabilities': list ( of probabilities of reaching each descendant node)
+    'alias': tuple (alias table used by play to sample a descendant, see build_samplers)
 
 if the value of 'type' equals 't'
 
     'pay': float (payoff if terminal node is reached) 
+
+The root node (tree[0]) also keeps information about the whole tree:
+
+   'index': TreeIndex (structure of the tree, see get_index)
+  'solved': boolean value (True if every 'subvalue' is from solve)
+'strategy': list (optimal strategy found by the last solve)
+   'dirty': set (of nodes edited since the last solve, see resolve)
+ 'checked': boolean value (True if check_tree found no problems since the last edit)
 """
 
 
@@ -36,7 +67,8 @@ def short_menu():
     print('-----------------------------')
     print('help  | exit | load | save  | calc |')
     print('build | show | edit | solve | see  |')
-    print('strat | path | play | sim   |')
+    print('strat | path | play | sim   | exact |')
+    print('stats | evpi |')
     print('-----------------------------')
 
 
@@ -155,7 +187,7 @@ def fill_node(tree, node_index):
 
     # Process terminal node
     if tree[node_index]['type'] == "t":
-        tree[node_index]['pay'] = get_node_pay()
+        tree[node_index]['pay'] = float(get_node_pay())
         tree[node_index]['used'] = True
         tree[node_index]['subvalue'] = tree[node_index]['pay']
         tree[node_index]['filled'] = True
@@ -171,6 +203,7 @@ def fill_node(tree, node_index):
 
     for k in des:
         tree.append(k)
+    invalidate_index(tree)
 
     # This block of code asks the user for the probability that nature
     # will choose a descendant node
@@ -193,156 +226,598 @@ def build():
     node_index = 0
     tree = fill_node(tree, node_index)
 
-    # go thru the tree and process any new nodes
-    # that were added by the descendant processing
-    # in fill_node.
+    # fill the nodes added by fill_node in the order they were added,
+    # keeping a queue of them instead of searching the tree for
+    # unfilled nodes after every fill.
 
-    done = False
-    while not done:
-        k = len(tree)
-        done = True
-        for j in range(k):
-            if not tree[j]['filled']:
-                done = False
-                tree = fill_node(tree, j)  # Note more descendants could be added at this point
+    pending = deque(tree[0].get('descendants', ()))
+    while pending:
+        j = pending.popleft()
+        tree = fill_node(tree, j)
+        pending.extend(tree[j].get('descendants', ()))
 
     return tree
 
 
-def show(tree, node_index = 0, level = 0):
-    """Recursive function to print the tree on the console with indentations for levels of the tree"""
-    print('   ' * level + '{}-'.format(node_index), end="")
-    print('{}'.format(tree[node_index]['name']), end="")
-    # note end = "" does not move to the next line
-    print('#{}'.format(tree[node_index]['ancestor']), end="")
-    if tree[node_index]['type'] == 't':
-        print("(t){}".format(tree[node_index]['pay']))
-        return
-    elif tree[node_index]['type'] == 'd':
-        print("(d)")
-    elif tree[node_index]['type'] == 'n':
-        print("(n)[", end="")
-        for k in range(len(tree[node_index]['descendants'])):
-            print("{}".format(tree[node_index]['probabilities'][k]), end="")
-            if k < len(tree[node_index]['descendants']) - 1:
-                print(',', end="")
-        print(']')
-    for k in tree[node_index]['descendants']:
-        show(tree, k, level + 1)
-
-
-def show_computed_values(tree, node_index, level):
-    print('   ' * level + '{}-'.format(node_index), end="")
-    print('{}'.format(tree[node_index]['name']), end="")
-    # note end = "" does not move to the next line
-    print('#{}'.format(tree[node_index]['ancestor']), end="")
-    if tree[node_index]['type'] == 't':
-        print("(t){} (V){}".format(tree[node_index]['pay'], tree[node_index]['subvalue']))
-        return
-    elif tree[node_index]['type'] == 'd':
-        print("(d) (V){}".format(tree[node_index]['subvalue']))
-    elif tree[node_index]['type'] == 'n':
-        print("(n)[", end="")
-        for k in range(len(tree[node_index]['descendants'])):
-            print("{}".format(tree[node_index]['probabilities'][k]), end="")
-            if k < len(tree[node_index]['descendants']) - 1:
-                print(',', end="")
-        print('](V){}'.format(tree[node_index]['subvalue']))
-    for k in tree[node_index]['descendants']:
-        show_computed_values(tree, k, level + 1)
-
-
-def show_strategy(strategy, next_choice, tree, node_index, level):
-    """Recursive function to print the tree and show the strategy with *
-        arg: strategy, list of decisions
-        arg: next_choice, node to *
-        arg: tree, decision tree list of dictionary nodes
-        arg: node_index, current node to work on
-        arg: level, current level of the tree to work on"""
+#  Building trees in code.  A TreeBuilder collects nodes under keys chosen by
+#  the caller (ids from another system, say) and edges between those keys, in
+#  any order.  build then walks the edges from the root with a work queue and
+#  numbers the nodes breadth first, as build does.  tree_from_json and
+#  tree_from_csv fill a TreeBuilder in one pass over their input.
 
-    if node_index == next_choice:
-        print("*", end="")
-    else:
-        print(" ", end="")
-    print('   ' * level + '{}-'.format(node_index), end="")
-    if node_index == next_choice:
-        print("*", end="")
+IMPORT_EXTENSIONS = ('.json', '.csv')
+
+
+class TreeBuilder:
+    """ Collects nodes and edges and turns them into a tree
+
+        nodes: dictionary of key to the node's dictionary (name, type, pay)
+        edges: dictionary of key to the list of (descendant key, probability)
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.edges = {}
+
+    def add_node(self, key, name = None, type = None, pay = None):
+        """ Adds (or updates) the node called key
+
+            name defaults to str(key).  If type is None it is worked out by build:
+            't' without edges, 'n' if the edges have probabilities, else 'd'.
+        """
+        node = self.nodes.setdefault(key, {})
+        if name is not None:
+            node['name'] = str(name)
+        if type is not None:
+            if type not in ('d', 'n', 't'):
+                raise ValueError('node {!r} has type {!r}, not d, n or t'.format(key, type))
+            node['type'] = type
+        if pay is not None:
+            node['pay'] = float(pay)
+        return self
+
+    def add_edge(self, ancestor, descendant, probability = None):
+        """Adds an edge from ancestor to descendant, the probability is for nature nodes"""
+        self.nodes.setdefault(ancestor, {})
+        self.nodes.setdefault(descendant, {})
+        if probability is not None:
+            probability = float(probability)
+        self.edges.setdefault(ancestor, []).append((descendant, probability))
+        return self
+
+    def add_nodes(self, rows):
+        """Adds every (key, name, type, pay) row of rows"""
+        for row in rows:
+            self.add_node(*row)
+        return self
+
+    def add_edges(self, rows):
+        """Adds every (ancestor, descendant) or (ancestor, descendant, probability) row"""
+        for row in rows:
+            self.add_edge(*row)
+        return self
+
+    def find_root(self):
+        """The only node that is not a descendant of another node"""
+        reached = set()
+        for edges in self.edges.values():
+            reached.update(key for key, probability in edges)
+        roots = [key for key in self.nodes if key not in reached]
+        if len(roots) != 1:
+            raise ValueError('a tree needs exactly one root, found {}'.format(len(roots)))
+        return roots[0]
+
+    def build(self, root = None):
+        """ Numbers the nodes breadth first from root (default find_root)
+
+            return: tree, a list of dictionary nodes
+        """
+        if root is None:
+            root = self.find_root()
+        if root not in self.nodes:
+            raise KeyError('no node {!r}'.format(root))
+        tree = []
+        position = {root: 0}
+        queue = [root]
+        for key in queue:  # queue grows while it is walked
+            info = self.nodes[key]
+            edges = self.edges.get(key, ())
+            node = {'name': info.get('name', str(key)), 'ancestor': -1, 'filled': True}
+            node_type = info.get('type')
+            if node_type is None:
+                if not edges:
+                    node_type = 't'
+                elif any(probability is not None for k, probability in edges):
+                    node_type = 'n'
+                else:
+                    node_type = 'd'
+            node['type'] = node_type
+            if node_type == 't':
+                if edges:
+                    raise ValueError('terminal node {!r} has descendants'.format(key))
+                if 'pay' not in info:
+                    raise ValueError('terminal node {!r} has no pay'.format(key))
+                node['pay'] = info['pay']
+                node['subvalue'] = info['pay']
+                node['used'] = True
+            else:
+                if not edges:
+                    raise ValueError('node {!r} of type {} has no descendants'.format(key, node_type))
+                node['descendants'] = descendants = []
+                for child, probability in edges:
+                    if child in position:
+                        raise ValueError('node {!r} is reached twice, the edges are not a tree'
+                                         .format(child))
+                    position[child] = len(queue)
+                    descendants.append(len(queue))
+                    queue.append(child)
+                if node_type == 'n':
+                    if any(probability is None for k, probability in edges):
+                        raise ValueError('nature node {!r} needs a probability on every edge'
+                                         .format(key))
+                    node['probabilities'] = [probability for k, probability in edges]
+                node['subvalue'] = 0.0
+                node['used'] = False
+            tree.append(node)
+        if len(tree) != len(self.nodes):
+            raise ValueError('{} nodes cannot be reached from the root'
+                             .format(len(self.nodes) - len(tree)))
+        for k, node in enumerate(tree):
+            for j in node.get('descendants', ()):
+                tree[j]['ancestor'] = k
+        return build_samplers(check_tree(tree))
+
+
+def tree_from_json(source):
+    """ Imports a tree from JSON in one of two forms
+
+            {"nodes": [{"id": 1, "name": "a", "type": "n", "pay": 0.0}, ...],
+             "edges": [{"from": 1, "to": 2, "prob": 0.5}, ...]}
+
+        or nested, each node with its descendants:
+
+            {"name": "a", "children": [{"name": "b", "prob": 0.5, "pay": 10}, ...]}
+
+        Missing types are worked out as in TreeBuilder.add_node.
+
+        args: source, a file name or an open text file
+        return: tree, a list of dictionary nodes
+    """
+    if isinstance(source, (str, bytes, os.PathLike)):
+        with open(source, 'r') as file:
+            return tree_from_json(file)
+    data = json.load(source)
+    builder = TreeBuilder()
+    if 'nodes' in data:
+        for node in data['nodes']:
+            builder.add_node(node['id'], node.get('name'), node.get('type'), node.get('pay'))
+        for edge in data.get('edges', ()):
+            builder.add_edge(edge['from'], edge['to'], edge.get('prob'))
+        return builder.build()
+    stack = [(data, None, None)]  # explicit stack, deep trees do not hit the recursion limit
+    count = 0
+    while stack:
+        node, ancestor, probability = stack.pop()
+        key = count
+        count += 1
+        builder.add_node(key, node.get('name'), node.get('type'), node.get('pay'))
+        if ancestor is not None:
+            builder.add_edge(ancestor, key, probability)
+        for child in reversed(node.get('children', ())):
+            stack.append((child, key, child.get('prob')))
+    return builder.build(0) if count else []
+
+
+def tree_from_csv(source):
+    """ Imports a tree from an edge list with a header row, for example
+
+            parent,child,prob,name,type,pay
+            ,root,,decide,d,
+            root,sure,,sure_thing,t,50
+            root,flip,,flip_coin,n,
+
+        Every row is one node (child) and the edge that leads to it, an empty
+        parent marks the root.  Only parent and child are needed; the other
+        columns can be left out or empty (see TreeBuilder.add_node).
+
+        args: source, a file name or an open text file
+        return: tree, a list of dictionary nodes
+    """
+    if isinstance(source, (str, bytes, os.PathLike)):
+        with open(source, 'r', newline='') as file:
+            return tree_from_csv(file)
+    builder = TreeBuilder()
+    root = None
+    for row in csv.DictReader(source):
+        key = row['child']
+        builder.add_node(key, row.get('name') or None, row.get('type') or None,
+                         row.get('pay') or None)
+        if row.get('parent'):
+            builder.add_edge(row['parent'], key, row.get('prob') or None)
+        else:
+            root = key
+    return builder.build(root) if builder.nodes else []
+
+
+def random_tree(num_nodes, branching = 2, max_depth = None, decision_share = 0.5,
+                skew = 0.0, seed = None):
+    """ Builds a random tree, used to test and benchmark the solvers
+
+        args: num_nodes, number of nodes to make (the tree can be a little smaller)
+              branching, number of descendants of every decision and nature node
+              max_depth, nodes at this depth are terminal (default no limit)
+              decision_share, chance that a non terminal node is a decision node
+              skew, nature node probabilities are proportional to 1 / (k + 1) ** skew
+                    in a random order, so 0.0 gives equal probabilities
+              seed, seed for the random numbers
+        return: tree, a list of dictionary nodes
+    """
+    rng = random.Random(seed)
+    weights = [1.0 / (k + 1) ** skew for k in range(branching)]
+    total = sum(weights)
+    tree = [{'ancestor': -1, 'depth': 0}]
+    for index, node in enumerate(tree):  # tree grows while it is walked
+        depth = node.pop('depth')
+        node['name'] = 'x_{}'.format(index)
+        node['filled'] = True
+        if (len(tree) + branching > num_nodes or branching < 1
+                or (max_depth is not None and depth >= max_depth)):
+            node['type'] = 't'
+            node['pay'] = round(rng.uniform(0.0, 100.0), 2)
+            continue
+        node['type'] = 'd' if rng.random() < decision_share else 'n'
+        node['descendants'] = list(range(len(tree), len(tree) + branching))
+        if node['type'] == 'n':
+            probs = [w / total for w in weights]
+            rng.shuffle(probs)
+            node['probabilities'] = probs
+        for k in range(branching):
+            tree.append({'ancestor': index, 'depth': depth + 1})
+    return tree
+
+
+#  The show functions and path print one line per node.  They walk the tree
+#  with an explicit stack (so deep trees do not hit the recursion limit) and
+#  write the lines to the file in large chunks.  max_depth stops the walk that
+#  many levels below the first node, and max_nodes after that many lines.
+
+RENDER_CHUNK = 4096  # lines written to the file at a time
+
+
+def render(visit, start, file = None, max_depth = None, max_nodes = None):
+    """ Used by show, show_computed_values, show_strategy and path to write a tree
+
+        args: visit, function of (item, collapse) returning the text of a node and
+                     the items of its descendants.  When collapse is True the
+                     descendants are left out and the text says what was skipped.
+              start, the item of the first node, a tuple whose second entry is
+                     the depth below the first node (0)
+              file, file like object to write to (default sys.stdout)
+    """
+    if file is None:
+        file = sys.stdout
+    lines = []
+    count = 0
+    stack = [start]
+    while stack:
+        if max_nodes is not None and count >= max_nodes:
+            lines.append('... stopped after {} nodes\n'.format(max_nodes))
+            break
+        item = stack.pop()
+        text, children = visit(item, max_depth is not None and item[1] >= max_depth)
+        lines.append(text)
+        count += 1
+        stack.extend(reversed(children))
+        if len(lines) >= RENDER_CHUNK:
+            file.write(''.join(lines))
+            lines = []
+    file.write(''.join(lines))
+
+
+def node_text(node, values = False):
+    """Used by the show functions: type, payoff or probabilities (and value) of a node"""
+    if node['type'] == 't':
+        text = "(t){}".format(node['pay'])
+        if values:
+            text += " (V){}".format(node['subvalue'])
+    elif node['type'] == 'd':
+        text = "(d)"
+        if values:
+            text += " (V){}".format(node['subvalue'])
     else:
-        print(" ", end="")
+        text = "(n)[" + ','.join("{}".format(p) for p in node['probabilities']) + "]"
+        if values:
+            text += "(V){}".format(node['subvalue'])
+    return text
 
-    print('{}'.format(tree[node_index]['name']), end="")
-    # note end = "" does not move to the next line
-    if tree[node_index]['type'] == 't':
-        print("(t){}".format(tree[node_index]['pay']))
-        return
-    elif tree[node_index]['type'] == 'd':
-        print("(d)")
-        next_choice = strategy[node_index]
-    elif tree[node_index]['type'] == 'n':
-        print("(n)[", end="")
-        for k in range(len(tree[node_index]['descendants'])):
-            print("{}".format(tree[node_index]['probabilities'][k]), end="")
-            if k < len(tree[node_index]['descendants']) - 1:
-                print(',', end="")
-        print(']')
-    for k in tree[node_index]['descendants']:
-        show_strategy(strategy, next_choice, tree, k, level + 1)
-
-
-def path(strategy, tree, node = 0, indent = ""):
-    """Recursive function to print the tree and show the strategy with *
+
+def hidden_text(tree, node_index, indent):
+    """Used by the show functions for a subtree beyond max_depth"""
+    return "{}   ... {} more nodes\n".format(indent, get_index(tree).size[node_index] - 1)
+
+
+def show(tree, node_index = 0, level = 0, file = None, max_depth = None, max_nodes = None):
+    """Prints the tree on the console (or file) with indentations for levels of the tree"""
+    def visit(item, collapse):
+        k, depth = item
+        node = tree[k]
+        indent = '   ' * (level + depth)
+        text = indent + '{}-{}#{}'.format(k, node['name'], node['ancestor']) + node_text(node) + '\n'
+        if node['type'] == 't':
+            return text, ()
+        if collapse:
+            return text + hidden_text(tree, k, indent), ()
+        return text, [(j, depth + 1) for j in node['descendants']]
+    render(visit, (node_index, 0), file, max_depth, max_nodes)
+
+
+def show_computed_values(tree, node_index = 0, level = 0, file = None, max_depth = None, max_nodes = None):
+    """Prints the tree like show, with the value of every node"""
+    def visit(item, collapse):
+        k, depth = item
+        node = tree[k]
+        indent = '   ' * (level + depth)
+        text = indent + '{}-{}#{}'.format(k, node['name'], node['ancestor']) + node_text(node, True) + '\n'
+        if node['type'] == 't':
+            return text, ()
+        if collapse:
+            return text + hidden_text(tree, k, indent), ()
+        return text, [(j, depth + 1) for j in node['descendants']]
+    render(visit, (node_index, 0), file, max_depth, max_nodes)
+
+
+def show_strategy(strategy, next_choice, tree, node_index, level, file = None, max_depth = None, max_nodes = None):
+    """Prints the tree and shows the strategy with *
         arg: strategy, list of decisions
         arg: next_choice, node to *
         arg: tree, decision tree list of dictionary nodes
         arg: node_index, current node to work on
         arg: level, current level of the tree to work on"""
+    def visit(item, collapse):
+        k, depth, choice = item
+        node = tree[k]
+        star = "*" if k == choice else " "
+        indent = '   ' * (level + depth)
+        text = star + indent + '{}-'.format(k) + star + node['name'] + node_text(node) + '\n'
+        if node['type'] == 't':
+            return text, ()
+        if collapse:
+            return text + " " + hidden_text(tree, k, indent), ()
+        if node['type'] == 'd':
+            choice = strategy[k]
+        return text, [(j, depth + 1, choice) for j in node['descendants']]
+    render(visit, (node_index, 0, next_choice), file, max_depth, max_nodes)
+
+
+def path(strategy, tree, node = 0, indent = "", file = None, max_depth = None, max_nodes = None):
+    """Prints the nodes reached when strategy is played
+        arg: strategy, list of decisions (or dictionary for a LazyTree)
+        arg: tree, decision tree list of dictionary nodes or a LazyTree
+        arg: node, node to start from
+        arg: indent, text printed before the first node"""
+    def visit(item, collapse):
+        k, depth = item
+        current = tree[k]
+        prefix = indent + "  " * depth
+        text = prefix + current['name']
+        if current['type'] == 't':
+            return text + " " + str(current['pay']) + '\n', ()
+        if current['type'] == 'n':
+            text += " " + str(current['probabilities'])
+        if collapse:
+            return text + '\n' + prefix + "  ...\n", ()
+        if current['type'] == 'd':
+            return text + '\n', [(strategy[k], depth + 1)]
+        return text + '\n', [(j, depth + 1) for j in current['descendants']]
+    render(visit, (node, 0), file, max_depth, max_nodes)
+
+
+#  Compact nodes.  A dictionary node costs a few hundred bytes of hash table.
+#  The classes below keep the usual keys in __slots__ instead, one class per
+#  node type, and store payoffs, values and ancestors as native numbers.  They
+#  answer node['key'], node.get, node.pop, 'key' in node and so on like a
+#  dictionary, so every function here works on them.  Keys that are not slots
+#  (the root node's 'index', 'solved', ...) go in a dictionary made when first
+#  needed.  Reading a key is a method call, so solving takes longer than on
+#  dictionary nodes; use them when memory is the limit.  See compact_tree.
+
+NUMBER_KEYS = {'pay': float, 'subvalue': float, 'ancestor': int}
+
+
+class Node:
+    """ Base of the compact node classes
+
+        type:          'd', 'n' or 't', fixed by the class
+        keys_of_class: the slots that are read and written as keys
+        extra:         dictionary of the other keys, None while there are none
+    """
 
-    print(indent + tree[node]['name'], end = "")
-    if tree[node]['type'] == 't':
-        print(" " + str(tree[node]['pay']), end = "")
-        print()
-        return
-    elif tree[node]['type'] == 'd':
-        print()
-        indent = indent + "  "
-        path(strategy, tree, strategy[node], indent)
-    elif tree[node]['type']  == 'n':
-        print(" " + str(tree[node]['probabilities']), end = "")
-        print()
-        indent = indent + "  "
-        for k in tree[node]['descendants']:
-            path(strategy, tree, k, indent)
+    __slots__ = ('name', 'ancestor', 'filled', 'used', 'subvalue', 'extra')
+    type = None
+    keys_of_class = ('name', 'ancestor', 'filled', 'used', 'subvalue')
+
+    def __init__(self, **items):
+        self.extra = None
+        for key, value in items.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key == 'type':
+            return self.type
+        if key in self.keys_of_class:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.keys_of_class:
+            convert = NUMBER_KEYS.get(key)
+            setattr(self, key, value if convert is None else convert(value))
+        elif key == 'type':
+            if value != self.type:
+                raise ValueError('a {} cannot change its type to {!r}, make a new node'
+                                 .format(type(self).__name__, value))
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.keys_of_class:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif key != 'type' and self.extra is not None and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
 
+    def __contains__(self, key):
+        if key in self.keys_of_class:
+            return hasattr(self, key)
+        return key == 'type' or (self.extra is not None and key in self.extra)
 
-def save_tree(tree):
-    """Saves a tree.  Will ask for filename.  Filename must not already exist"""
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
 
-    file_name = input('Enter a file name ')
-    try:
-        file = open(file_name + '.txt', 'r')
-        file.close()
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def setdefault(self, key, default = None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def keys(self):
+        keys = ['type'] + [key for key in self.keys_of_class if hasattr(self, key)]
+        if self.extra:
+            keys.extend(self.extra)
+        return keys
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def to_dict(self):
+        """Returns the node as a dictionary node"""
+        return dict(self.items())
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, self.to_dict())
+
+
+class TerminalNode(Node):
+    __slots__ = ('pay',)
+    type = 't'
+    keys_of_class = Node.keys_of_class + ('pay',)
+
+
+class DecisionNode(Node):
+    __slots__ = ('descendants',)
+    type = 'd'
+    keys_of_class = Node.keys_of_class + ('descendants',)
+
+
+class NatureNode(Node):
+    __slots__ = ('descendants', 'probabilities', 'alias')
+    type = 'n'
+    keys_of_class = Node.keys_of_class + ('descendants', 'probabilities', 'alias')
+
+
+NODE_CLASSES = {'t': TerminalNode, 'd': DecisionNode, 'n': NatureNode}
+
+
+def make_node(node):
+    """Returns a compact node with the keys of a dictionary node"""
+    items = dict(node)
+    return NODE_CLASSES[items.pop('type')](**items)
+
+
+def compact_tree(tree):
+    """ Replaces the dictionary nodes of a tree by compact nodes, in place
+
+        args: tree, a list of dictionary nodes
+        return: tree, the same list holding TerminalNode, DecisionNode and NatureNode
+    """
+    for k, node in enumerate(tree):
+        if not isinstance(node, Node):
+            tree[k] = make_node(node)
+    return tree
+
+
+def tree_file_name(file_name):
+    """File names ending in .dtb are binary tree files, anything else gets .txt added"""
+    if file_name.endswith(BINARY_EXTENSION):
+        return file_name
+    return file_name + '.txt'
+
+
+def write_tree(tree, target):
+    """ Writes a tree in the text format read by load_tree
+
+        args: tree, a list of dictionary nodes
+              target, a file name (including .txt) or an open text file
+    """
+    if isinstance(target, (str, bytes, os.PathLike)):
+        with open(target, 'w', buffering=LOAD_BUFFER_SIZE) as file:
+            return write_tree(tree, file)
+    lines = []
+    for k, node in enumerate(tree):
+        lines.append('node,' + str(k) + '\n')
+        lines.append('name,' + node['name'] + '\n')
+        lines.append('type,' + node['type'] + '\n')
+        if node['type'] == 't':
+            lines.append('pay,' + str(node['pay']) + '\n')
+        else:
+            lines.append('length,' + str(len(node['descendants'])) + '\n')
+            for j in node['descendants']:
+                lines.append('descendant,' + str(j) + '\n')
+            if node['type'] == 'n':
+                for p in node['probabilities']:
+                    lines.append('prob,' + str(p) + '\n')
+        if len(lines) > 10000:
+            target.write(''.join(lines))
+            lines = []
+    target.write(''.join(lines))
+
+
+def save_tree(tree, file_name = None):
+    """Saves a tree.  Will ask for filename if none is given.  Filename must not already exist.
+    A filename ending in .dtb is saved in the binary format, see save_binary"""
+
+    if file_name is None:
+        file_name = input('Enter a file name ')
+    path = tree_file_name(file_name)
+    if os.path.exists(path):
         print("File {} already exists".format(file_name))
         return
-    except IOError:
-        print('File {} will now be written.'.format(file_name))
-
-    file = open(file_name + '.txt', 'w')
-    for k, val in enumerate(tree):
-        file.write('node,' + str(k) + '\n')
-        file.write('name,' + tree[k]['name'] + '\n')
-        file.write('type,' + tree[k]['type'] + '\n')
-        if tree[k]['type'] == 't':
-            file.write('pay,' + str(tree[k]['pay']) + '\n')
-        else:
-            des_length = len(tree[k]['descendants'])
-            file.write('length,' + str(des_length) + '\n')
-            for j in range(des_length):
-                file.write('descendant,' + str(tree[k]['descendants'][j]) + '\n')
-            if tree[k]['type'] == 'n':
-                for j in range(des_length):
-                    file.write('prob,' + str(tree[k]['probabilities'][j]) + '\n')
-    file.close()
-    print(file_name + ".txt has been saved")
+    print('File {} will now be written.'.format(file_name))
+
+    if path.endswith(BINARY_EXTENSION):
+        save_binary(tree, path)
+    else:
+        write_tree(tree, path)
+    print(path + " has been saved")
 
 
 def parse_line(line):
@@ -353,61 +828,429 @@ def parse_line(line):
 
 def get_ancestory(tree):
     """Calculates all the ancestors in a tree"""
-    # now caluclate ancestory
-    ancestory = [-1 for k in range(len(tree))]
+    if not tree:
+        return tree
+    parent = get_index(tree).parent
     for k, node in enumerate(tree):
-        if node['type'] != "t":
-            for j in node['descendants']:
-                ancestory[j] = k
-        for k, node in enumerate(tree):
-            node['ancestor'] = int(ancestory[k])
+        node['ancestor'] = parent[k]
     return tree
 
 
-def load():
-    """Loads a tree.  Will ask for filename.  Checks that .txt file exists"""
-    print("Enter a file name:")
-    file_name = input('')
+#  Validation.  check_tree is run by load_tree, TreeBuilder.build, solve and
+#  resolve so that a broken tree is reported when it is read instead of making
+#  solve or play fail later.  A tree that passed is marked 'checked' on its
+#  root node until its structure changes (see invalidate_index); after that
+#  only the nodes marked by mark_dirty are checked again.
+
+PROBABILITY_TOLERANCE = .000001  # same as get_node_probabilities
+
+
+class TreeValidationError(ValueError):
+    """ Raised by check_tree
+
+        problems: list of (node index, message), one for every problem found
+    """
+
+    def __init__(self, problems):
+        ValueError.__init__(self, problems)  # args are problems so it can be pickled
+        self.problems = problems
+
+    def __str__(self):
+        return '{} problem(s) in the tree\n'.format(len(self.problems)) + \
+            '\n'.join('node {}: {}'.format(k, message) for k, message in self.problems)
+
+
+def validate_tree(tree, tolerance = PROBABILITY_TOLERANCE):
+    """ Finds everything that would stop solve, play or show from working
+
+        Checks node types, that payoffs are numbers, that decision and nature
+        nodes have descendants that are nodes of the tree, that nature nodes have
+        one probability per descendant summing to 1, that there are no cycles and
+        that every node can be reached from node 0.  A node may be the descendant
+        of several nodes, as in a dag made by dedupe_tree.  The probability sums
+        of all nature nodes are checked together with numpy when it is installed.
+
+        args: tree, a list of dictionary nodes
+              tolerance, how far from 1 the probabilities may sum
+        return: problems, list of (node index, message), empty if the tree is fine
+    """
+    n = len(tree)
+    problems = []
+    children = [()] * n  # descendants that are nodes of the tree
+    waiting = [0] * n  # number of nodes that branch to each node
+    nature = []  # nature nodes with one probability per descendant
+    for k, node in enumerate(tree):
+        node_type = node.get('type')
+        if node_type == 't':
+            message = pay_problem(node.get('pay'))
+            if message:
+                problems.append((k, message))
+            continue
+        if node_type not in ('d', 'n'):
+            problems.append((k, 'type {!r} is not d, n or t'.format(node_type)))
+            continue
+        descendants = node.get('descendants')
+        if not descendants:
+            problems.append((k, '{} node has no descendants'
+                             .format('decision' if node_type == 'd' else 'nature')))
+            continue
+        valid = []
+        for j in descendants:
+            if type(j) is int and 0 <= j < n:
+                valid.append(j)
+                waiting[j] += 1
+            else:
+                problems.append((k, 'descendant {!r} is not a node of the tree'.format(j)))
+        children[k] = valid
+        if node_type == 'n':
+            probs = node.get('probabilities')
+            if probs is None or len(probs) != len(descendants):
+                problems.append((k, '{} probabilities for {} descendants'
+                                 .format(0 if probs is None else len(probs), len(descendants))))
+            else:
+                nature.append(k)
+    problems.extend(check_probabilities(tree, nature, tolerance))
+
+    # cycles: repeatedly remove nodes nothing branches to, what is left is on
+    # (or below) a cycle
+    queue = [k for k in range(n) if waiting[k] == 0]
+    roots = len(queue)
+    for k in queue:  # queue grows while it is walked
+        for j in children[k]:
+            waiting[j] -= 1
+            if waiting[j] == 0:
+                queue.append(j)
+    on_cycle = bytearray(n)
+    if len(queue) < n:
+        for k in range(n):
+            if waiting[k] > 0:
+                on_cycle[k] = 1
+                problems.append((k, 'is on a cycle or below one'))
+
+    # reachability from node 0, without cycles node 0 reaches everything
+    # when nothing else is a root
+    reached = bytearray(n)
+    if n and len(queue) == n and roots == 1 and queue[0] == 0:
+        reached = b'\x01' * n
+    elif n:
+        reached[0] = 1
+        stack = [0]
+        while stack:
+            for j in children[stack.pop()]:
+                if not reached[j]:
+                    reached[j] = 1
+                    stack.append(j)
+    for k in range(n):
+        if not reached[k] and not on_cycle[k]:
+            problems.append((k, 'can not be reached from node 0'))
+    problems.sort(key=lambda problem: problem[0])
+    return problems
+
+
+def pay_problem(pay):
+    """Used by validate_tree, returns what is wrong with a payoff or None"""
     try:
-        file = open(file_name + '.txt', 'r')
-        file.close()
-        print("File {} will now be loaded".format(file_name))
-    except IOError:
+        pay = float(pay)
+    except (TypeError, ValueError):
+        return 'pay {!r} is not a number'.format(pay)
+    if pay != pay or pay in (float('inf'), float('-inf')):
+        return 'pay is {}'.format(pay)
+    return None
+
+
+def check_probabilities(tree, nature, tolerance = PROBABILITY_TOLERANCE):
+    """ Used by validate_tree to check the probabilities of the nature nodes in nature
+
+        return: problems, list of (node index, message)
+    """
+    if not nature:
+        return []
+    if np is not None:
+        counts = [len(tree[k]['probabilities']) for k in nature]
+        try:
+            values = np.array([p for k in nature for p in tree[k]['probabilities']], dtype=float)
+        except (TypeError, ValueError):
+            values = None  # something is not a number, the loop below finds it
+        if values is not None:
+            starts = np.zeros(len(counts), dtype=np.int64)
+            np.cumsum(counts[:-1], out=starts[1:])
+            bad = np.logical_or.reduceat((values < 0.0) | ~np.isfinite(values), starts)
+            sums = np.add.reduceat(values, starts)
+            bad |= ~(np.abs(sums - 1.0) <= tolerance)
+            nature = [nature[i] for i in np.flatnonzero(bad)]
+    problems = []
+    for k in nature:
+        probs = tree[k]['probabilities']
+        try:
+            probs = [float(p) for p in probs]
+        except (TypeError, ValueError):
+            problems.append((k, 'probabilities {} are not all numbers'.format(probs)))
+            continue
+        if any(p < 0.0 or p != p or p == float('inf') for p in probs):
+            problems.append((k, 'probabilities {} are not all between 0 and 1'.format(probs)))
+        elif not abs(sum(probs) - 1.0) <= tolerance:
+            problems.append((k, 'probabilities sum to {}'.format(sum(probs))))
+    return problems
+
+
+def check_tree(tree, tolerance = PROBABILITY_TOLERANCE):
+    """ Raises TreeValidationError listing every problem validate_tree finds
+
+        return: tree, marked 'checked'
+    """
+    problems = validate_tree(tree, tolerance)
+    if problems:
+        raise TreeValidationError(problems)
+    if tree:
+        tree[0]['checked'] = True
+    return tree
+
+
+def recheck_tree(tree, tolerance = PROBABILITY_TOLERANCE):
+    """ Used by solve and resolve, runs check_tree if the tree is not marked
+        'checked' and otherwise checks only the nodes edited since (see mark_dirty)
+    """
+    root = tree[0]
+    if not root.get('checked'):
+        return check_tree(tree, tolerance)
+    problems = []
+    nature = []
+    for k in sorted(root.get('dirty', ())):
+        node = tree[k]
+        if node['type'] == 't':
+            message = pay_problem(node.get('pay'))
+            if message:
+                problems.append((k, message))
+        elif node['type'] == 'n':
+            if len(node.get('probabilities') or ()) != len(node['descendants']):
+                problems.append((k, 'probabilities do not match the descendants'))
+            else:
+                nature.append(k)
+    problems.extend(check_probabilities(tree, nature, tolerance))
+    if problems:
+        raise TreeValidationError(sorted(problems))
+    return tree
+
+
+LOAD_BUFFER_SIZE = 1 << 20  # characters read from the file per bulk read
+
+
+def load_tree(source, compact = False, validate = True):
+    """ Reads a tree written by save_tree in a single streaming pass
+
+        args: source, a file name (including .txt) or an open text file.
+                      File names ending in .dtb are read with open_binary,
+                      .json with tree_from_json and .csv with tree_from_csv
+              compact, True to make compact nodes (see compact_tree)
+              validate, False to skip check_tree
+        return: tree, a list of dictionary nodes
+        raises: TreeValidationError if the tree is broken or a line of the file
+                can not be read (even if validate is False)
+    """
+    start = time.perf_counter()
+    if isinstance(source, (str, bytes, os.PathLike)):
+        extension = os.path.splitext(os.fsdecode(source))[1]
+        if extension in IMPORT_EXTENSIONS:
+            tree = tree_from_json(source) if extension == '.json' else tree_from_csv(source)
+            if compact:
+                compact_tree(tree)
+            if STATS is not None:
+                STATS.record('load', time.perf_counter() - start, nodes=len(tree))
+            return tree
+        if os.fspath(source)[-4:] in (BINARY_EXTENSION, BINARY_EXTENSION.encode()):
+            tree = open_binary(source).to_tree()
+            if validate:
+                check_tree(tree)
+            tree = build_samplers(tree)
+            if compact:
+                compact_tree(tree)
+            if STATS is not None:
+                STATS.record('load', time.perf_counter() - start, nodes=len(tree))
+            return tree
+        with open(source, 'r', buffering=LOAD_BUFFER_SIZE) as file:
+            return load_tree(file, compact, validate)
+    tree = []
+    node = None
+    num_lines = 0
+    problems = []  # lines that can not be read, as (node index, message)
+    for lines in iter(lambda: source.readlines(LOAD_BUFFER_SIZE), []):
+        for line in lines:
+            num_lines += 1
+            header, _, val = line.rstrip('\r\n').partition(',')
+            try:
+                if header == 'descendant':
+                    node['descendants'].append(int(val))
+                elif header == 'prob':
+                    node['probabilities'].append(float(val))
+                elif header == 'node':
+                    node = {}
+                    tree.append(node)
+                elif header == 'name':
+                    node['name'] = val
+                elif header == 'type':
+                    if compact and val[:1] in NODE_CLASSES:
+                        node = NODE_CLASSES[val[0]](**node)
+                        tree[-1] = node
+                    node['type'] = val[:1]
+                    if node['type'] != 't':
+                        node['descendants'] = []
+                    if node['type'] == 'n':
+                        node['probabilities'] = []
+                elif header == 'pay':
+                    node['pay'] = float(val)
+                elif header == 'length' or header == '':
+                    pass
+                else:
+                    print('***** error {}, {}'.format(header, val))
+            except ValueError:
+                problems.append((len(tree) - 1, 'line {}: {} {!r} is not a number'
+                                 .format(num_lines, header, val)))
+            except (TypeError, KeyError, AttributeError):
+                problems.append((len(tree) - 1, line_problem(num_lines, header, node)))
+    if problems:
+        if validate:  # add the problems of the nodes whose lines could all be read
+            unread = set(k for k, message in problems)
+            problems.extend(problem for problem in validate_tree(tree) if problem[0] not in unread)
+        raise TreeValidationError(sorted(problems, key=lambda problem: problem[0]))
+    if validate:
+        check_tree(tree)
+    tree = build_samplers(get_ancestory(tree))
+    if STATS is not None:
+        STATS.record('load', time.perf_counter() - start, nodes=len(tree), lines=num_lines)
+    return tree
+
+
+def line_problem(line_number, header, node):
+    """Used by load_tree, says why a line does not fit the node it belongs to"""
+    if node is None:
+        return 'line {}: {} comes before the first node line'.format(line_number, header)
+    if node.get('type') is None:
+        return 'line {}: {} comes before the type of the node'.format(line_number, header)
+    return 'line {}: a node of type {!r} has no {} lines'.format(line_number, node['type'], header)
+
+
+def load(file_name = None):
+    """Loads a tree.  Will ask for filename if none is given.  Checks that .txt, .dtb, .json or .csv file exists"""
+    if file_name is None:
+        print("Enter a file name:")
+        file_name = input('')
+    path = file_name if file_name.endswith(IMPORT_EXTENSIONS) else tree_file_name(file_name)
+    if not os.path.isfile(path):
         print('File {} does note exist.'.format(file_name))
         return
-    tree = []
-    file = open(file_name + '.txt', 'r')
-    des = []
-    pr = []
-    cur_node = -1
-    for line in file:
-        header, val = parse_line(line)
-        if header == 'node':
-            cur_node = int(val)
-            tree.append({})
-            des = []
-            pr = []
-        elif header == 'name':
-            tree[cur_node]['name'] = val[0:len(val) - 1]
-        elif header == 'type':
-            tree[cur_node]['type'] = val[0]
-        elif header == 'pay':
-            tree[cur_node]['pay'] = float(val)
-        elif header == 'length':
-            des = []
-            pr = []
-        elif header == 'descendant':
-            des.append(int(val))
-        elif header == 'prob':
-            pr.append(float(val))
-        else:
-            print('***** error {}, {}'.format(header, val))
-        if len(des) > 0:
-            tree[cur_node]['descendants'] = des
-        if len(pr) > 0:
-            tree[cur_node]['probabilities'] = pr
-    file.close()
-    return get_ancestory(tree)
+    print("File {} will now be loaded".format(file_name))
+    try:
+        return load_tree(path)
+    except (ValueError, KeyError, OSError) as error:  # TreeValidationError, or a broken import
+        print('File {} was not loaded.  {}'.format(file_name, error))
+        return
+
+
+#  Binary tree files (.dtb) hold the arrays of a CompiledTree.  After a fixed
+#  header come, each padded to a multiple of 8 bytes:
+#
+#      types     int8[n]      pay       float64[n]    parent   int64[n]
+#      offsets   int64[n + 1] children  int64[m]      probs    float64[m]
+#      name_offsets int64[n + 1]        names     utf-8 bytes
+#
+#  open_binary maps the file into memory so nothing is parsed; pages are read
+#  by the operating system when a solver first touches them.
+
+BINARY_MAGIC = b'DTREEBIN'
+BINARY_EXTENSION = '.dtb'
+BINARY_HEADER = struct.Struct('<8sqqq')  # magic, nodes, edges, bytes of names
+BINARY_SECTIONS = (('types', 'b'), ('pay', 'd'), ('parent', 'q'),
+                   ('offsets', 'q'), ('children', 'q'), ('probs', 'd'))
+
+
+class NameTable:
+    """Read only list of node names, decoded from a binary tree file when asked for"""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, k):
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError('name index out of range')
+        return str(self.data[self.offsets[k]:self.offsets[k + 1]], 'utf-8')
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+
+def save_binary(tree, file_name):
+    """ Saves a tree in the binary format read by open_binary
+
+        args: tree, a list of dictionary nodes or a CompiledTree
+              file_name, name of the file to write (normally ending in .dtb)
+    """
+    if sys.byteorder != 'little':
+        raise ValueError('binary tree files are only supported on little endian machines')
+    if not isinstance(tree, CompiledTree):
+        tree = compile_tree(tree)
+    names = [name.encode('utf-8') for name in tree.names]
+    name_offsets = array('q', [0])
+    for name in names:
+        name_offsets.append(name_offsets[-1] + len(name))
+    with open(file_name, 'wb') as file:
+        file.write(BINARY_HEADER.pack(BINARY_MAGIC, len(tree), len(tree.children),
+                                      name_offsets[-1]))
+        for key, typecode in BINARY_SECTIONS + (('name_offsets', 'q'),):
+            section = name_offsets if key == 'name_offsets' else getattr(tree, key)
+            data = memoryview(section).cast('B')
+            file.write(data)
+            file.write(bytes(-len(data) % 8))
+        file.write(b''.join(names))
+
+
+def open_binary(file_name):
+    """ Opens a binary tree file without parsing it
+
+        args: file_name, name of a file written by save_binary
+        return: a CompiledTree whose arrays are views into the memory mapped file
+    """
+    if sys.byteorder != 'little':
+        raise ValueError('binary tree files are only supported on little endian machines')
+    with open(file_name, 'rb') as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, n, m, name_size = BINARY_HEADER.unpack_from(data, 0)
+    if magic != BINARY_MAGIC:
+        raise ValueError('{} is not a binary tree file'.format(file_name))
+    view = memoryview(data)
+    pos = BINARY_HEADER.size
+    sections = {}
+    for key, typecode in BINARY_SECTIONS + (('name_offsets', 'q'),):
+        count = n + 1 if 'offsets' in key else (m if key in ('children', 'probs') else n)
+        size = count * struct.calcsize(typecode)
+        sections[key] = view[pos:pos + size].cast(typecode)
+        pos += size + (-size % 8)
+    names = NameTable(view[pos:pos + name_size], sections.pop('name_offsets'))
+    return CompiledTree(names, **sections)
+
+
+def convert_tree(source, target):
+    """ Converts a tree file between the text and binary formats without loss
+
+        args: source, name of the file to read (.txt or .dtb)
+              target, name of the file to write (.txt or .dtb)
+    """
+    if os.fspath(source).endswith(BINARY_EXTENSION):
+        tree = open_binary(source)
+    else:
+        tree = load_tree(source)
+    if os.fspath(target).endswith(BINARY_EXTENSION):
+        save_binary(tree, target)
+    elif isinstance(tree, CompiledTree):
+        write_tree(tree.to_tree(), target)
+    else:
+        write_tree(tree, target)
 
 
 def get_strategy(tree):
@@ -429,20 +1272,73 @@ def get_strategy(tree):
     return strategy
 
 
-def play_nature(probs):
-    """Used by play_tree to play a nature node"""
-    ran_num = random.random()
-    down_range = 0
-    up_range = 0
-    for k, val in enumerate(probs):
-        up_range += val
-        if down_range <= ran_num <= up_range:
-            return k
-        down_range += val
-    return len(probs)
+def play_nature(probs, rng = random):
+    """Used by play_tree to play a nature node without an alias table"""
+    cumulative = []
+    total = 0.0
+    for val in probs:
+        total += val
+        cumulative.append(total)
+    # bisect_right never picks a zero probability node and stays in range
+    # because rng.random() < 1.0 == total / total
+    return bisect.bisect_right(cumulative, rng.random() * total, 0, len(probs) - 1)
+
+
+def make_alias_table(probs):
+    """ Builds a Walker/Vose alias table so a descendant can be drawn in constant time
+
+        args: probs, list of probabilities of a nature node
+        return: (prob, alias) two lists as long as probs
+    """
+    m = len(probs)
+    total = float(sum(probs))
+    scaled = [p * m / total for p in probs]
+    prob = [1.0] * m
+    alias = list(range(m))
+    small = [k for k, p in enumerate(scaled) if p < 1.0]
+    large = [k for k, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        s = small.pop()
+        g = large.pop()
+        prob[s] = scaled[s]
+        alias[s] = g
+        scaled[g] = scaled[g] + scaled[s] - 1.0
+        if scaled[g] < 1.0:
+            small.append(g)
+        else:
+            large.append(g)
+    # whatever is left over is 1.0 up to rounding and keeps prob 1.0
+    return prob, alias
+
+
+def sample_alias(table, rng = random):
+    """Draws a descendant position from an alias table"""
+    prob, alias = table
+    u = rng.random() * len(prob)
+    k = int(u)
+    if k == len(prob):  # rng.random() * len(prob) can round up
+        k -= 1
+    if u - k < prob[k]:
+        return k
+    return alias[k]
+
+
+def build_samplers(tree):
+    """Adds an alias table to every nature node that does not have one yet"""
+    for node in tree:
+        if node['type'] == 'n' and 'alias' not in node:
+            node['alias'] = make_alias_table(node['probabilities'])
+    return tree
+
+
+def clear_samplers(tree):
+    """Removes the alias tables, they must be rebuilt after probabilities change"""
+    for node in tree:
+        node.pop('alias', None)
+    return tree
 
 
-def play(strategy, tree, cur_node = 0):
+def play(strategy, tree, cur_node = 0, rng = random):
     """play tree using strategy while starting at cur_node"""
     while True:
         if tree[cur_node]['type'] == 't':
@@ -451,26 +1347,44 @@ def play(strategy, tree, cur_node = 0):
         elif tree[cur_node]['type'] == 'd':
             cur_node = strategy[cur_node]
         elif tree[cur_node]['type'] == 'n':
-            k = play_nature(tree[cur_node]['probabilities'])
-            cur_node = tree[cur_node]['descendants'][k]
+            node = tree[cur_node]
+            if 'alias' not in node:
+                node['alias'] = make_alias_table(node['probabilities'])
+            k = sample_alias(node['alias'], rng)
+            cur_node = node['descendants'][k]
         else:
             print('***** error type {} unexpected'
                   .format(tree[cur_node]['type']))
 
 
-def sim_decisions(num_trials, tree, strategy):
+def sim_decisions(num_trials, tree, strategy, batch_size = None, workers = None, seed = None):
     """
     :param num_trials:
     :param tree:
     :param strategy:
+    :param batch_size: if given, run the trials with sim_counts_batched
+                       in batches of this many trials (needs numpy)
+    :param workers: if given, split the trials over this many processes
+                    with sim_counts_parallel
+    :param seed: seed that makes the run reproducible
     :return:
     """
-    res = []
-    for k in range(len(tree)):
-        res.append(0)
-    for k in range(num_trials):
-        oc = play(strategy, tree, 0)
-        res[oc[0]] += 1
+    start = time.perf_counter()
+    if workers:
+        res = sim_counts_parallel(num_trials, tree, strategy, workers, seed, batch_size)
+    elif batch_size:
+        res = sim_counts_batched(num_trials, tree, strategy, batch_size, seed)
+    else:
+        rng = random if seed is None else random.Random(seed)
+        res = []
+        for k in range(len(tree)):
+            res.append(0)
+        for k in range(num_trials):
+            oc = play(strategy, tree, 0, rng)
+            res[oc[0]] += 1
+    if STATS is not None:
+        STATS.record('sim', time.perf_counter() - start, trials=num_trials,
+                     draws=count_draws(tree, res))
     print(res)
     prob_outcome = [pr / num_trials for pr in res]
     payoffs = []
@@ -486,19 +1400,224 @@ def sim_decisions(num_trials, tree, strategy):
     return payoffs, ev
 
 
-def sim(strategy, tree, num_trials = 20):
+def count_draws(tree, res):
+    """ Number of random draws made by trials that ended at the nodes counted in res
+
+        A trial draws once at every nature node on the path to its terminal node,
+        so the draws are found from the counts without counting them in play.
+    """
+    index = get_index(tree)
+    natures = [0] * len(tree)  # nature nodes above each node
+    draws = 0
+    for k in index.pre_order:
+        p = index.parent[k]
+        if p != -1:
+            natures[k] = natures[p] + (tree[p]['type'] == 'n')
+        draws += res[k] * natures[k]
+    return draws
+
+
+def sim(strategy, tree, num_trials = 20, seed = None):
     """
     :param num_trials:
     :param tree:
     :param strategy:
+    :param seed: seed that makes the plays reproducible
     :return output
     """
+    rng = random if seed is None else random.Random(seed)
     output = []
     for k in range(num_trials):
-        output.append(play(strategy, tree))
+        output.append(play(strategy, tree, 0, rng))
     return output
 
 
+def outcome_probabilities(strategy, tree):
+    """ Exact probability of reaching every node when strategy is played from the root
+
+        args: strategy, list of choices at decision nodes
+              tree, a list of dictionary nodes
+        return: reach, list with the probability of reaching each node
+    """
+    reach = [0.0] * len(tree)
+    reach[0] = 1.0
+    # ancestors come before their descendants in the reversed post-order
+    for index in reversed(get_post_order(tree)):
+        p = reach[index]
+        if p == 0.0:
+            continue
+        node = tree[index]
+        if node['type'] == 'd':
+            reach[strategy[index]] += p
+        elif node['type'] == 'n':
+            for j, k in enumerate(node['descendants']):
+                reach[k] += p * node['probabilities'][j]
+    return reach
+
+
+def payoff_distribution(strategy, tree):
+    """ Exact distribution of the payoff when strategy is played
+
+        return: list of [payoff, probability] sorted by payoff
+    """
+    reach = outcome_probabilities(strategy, tree)
+    probs = {}
+    for k, node in enumerate(tree):
+        if node['type'] == 't' and reach[k] > 0.0:
+            pay = float(node['pay'])
+            probs[pay] = probs.get(pay, 0.0) + reach[k]
+    return [[pay, probs[pay]] for pay in sorted(probs)]
+
+
+def distribution_stats(distribution, quantiles = (0.05, 0.25, 0.5, 0.75, 0.95)):
+    """ Summarizes a payoff distribution
+
+        args: distribution, list of [payoff, probability] sorted by payoff
+              quantiles, levels q of the quantiles to report
+        return: mean, variance, and a dictionary with the smallest payoff x
+                with P(payoff <= x) >= q for every q in quantiles
+    """
+    mean = 0.0
+    for pay, p in distribution:
+        mean += pay * p
+    variance = 0.0
+    for pay, p in distribution:
+        variance += (pay - mean) ** 2 * p
+    values = {}
+    cumulative = [0.0]
+    for pay, p in distribution:
+        cumulative.append(cumulative[-1] + p)
+    for q in quantiles:
+        # tolerance so rounding in the sums does not skip a payoff
+        k = bisect.bisect_left(cumulative, q - .000000001, 1) - 1
+        values[q] = distribution[min(k, len(distribution) - 1)][0]
+    return mean, variance, values
+
+
+def show_distribution(strategy, tree):
+    """Prints the exact outcome of strategy, the answer sim estimates by simulation"""
+    reach = outcome_probabilities(strategy, tree)
+    for k, node in enumerate(tree):
+        if node['type'] == 't':
+            print(k, reach[k], node['pay'])
+    distribution = payoff_distribution(strategy, tree)
+    mean, variance, quantiles = distribution_stats(distribution)
+    print('distribution = {}'.format(distribution))
+    print('Expected value = {}'.format(mean))
+    print('variance = {}'.format(variance))
+    for q in sorted(quantiles):
+        print('quantile {} = {}'.format(q, quantiles[q]))
+
+
+#  Value of information.  Learning the outcome of a nature node before any
+#  decision is made (perfect information) or learning a signal about it
+#  (sample information) changes the value of that node and of the nodes above
+#  it, nothing else.  value_of_information therefore keeps the subvalues that
+#  solve found and, for every possible signal, recomputes only the ancestors
+#  of the nodes being learned about, deepest first.
+
+def value_of_information(tree, nodes, likelihood = None):
+    """ Expected value of learning about one uncertain event before deciding
+
+        args: tree, a list of dictionary nodes (not a dag)
+              nodes, index of a nature node, or a list of nature nodes that are
+                     the same event (same number of outcomes and probabilities)
+                     in different places of the tree.  Their k-th outcomes are
+                     learned together
+              likelihood, None for perfect information (EVPI), or for sample
+                     information (EVSI) a list with a row for every signal, row
+                     s holding P(signal s | outcome k) for every outcome k
+        return: dictionary with
+                'base': expected value without the information, tree[0]['subvalue']
+                'value': expected value when the information comes before deciding
+                'voi': value - base, the most the information is worth
+                'signals': list of (probability of the signal, expected value after it)
+    """
+    if isinstance(nodes, int):
+        nodes = [nodes]
+    nodes = sorted(set(nodes))
+    if not nodes:
+        raise ValueError('no nature node given')
+    for k in nodes:
+        if tree[k]['type'] != 'n':
+            raise ValueError('node {} is not a nature node'.format(k))
+    prior = [float(p) for p in tree[nodes[0]]['probabilities']]
+    for k in nodes[1:]:
+        probs = tree[k]['probabilities']
+        if len(probs) != len(prior) or any(abs(p - q) > PROBABILITY_TOLERANCE
+                                           for p, q in zip(probs, prior)):
+            raise ValueError('nodes {} and {} are not the same event'.format(nodes[0], k))
+    if likelihood is None:
+        likelihood = [[1.0 if j == k else 0.0 for j in range(len(prior))]
+                      for k in range(len(prior))]
+    for row in likelihood:
+        if len(row) != len(prior):
+            raise ValueError('every likelihood row needs {} entries'.format(len(prior)))
+    for k in range(len(prior)):
+        if abs(sum(row[k] for row in likelihood) - 1.0) > PROBABILITY_TOLERANCE:
+            raise ValueError('the signal probabilities of outcome {} do not sum to 1'.format(k))
+
+    resolve(tree)  # solves the tree, or brings it up to date after mark_dirty
+    base = tree[0]['subvalue']
+    index = get_index(tree)
+    parent = index.parent
+    depth = index.depth
+    affected = set()
+    for k in nodes:
+        while k != -1 and k not in affected:
+            affected.add(k)
+            k = parent[k]
+    order = sorted(affected, key=lambda k: -depth[k])
+    learned = set(nodes)
+
+    signals = []
+    value = 0.0
+    for row in likelihood:
+        p_signal = sum(p * l for p, l in zip(prior, row))
+        if p_signal <= 0.0:
+            continue
+        posterior = [p * l / p_signal for p, l in zip(prior, row)]
+        values = {}
+        for k in order:
+            node = tree[k]
+            sub = [values[j] if j in values else tree[j]['subvalue'] for j in node['descendants']]
+            if k in learned:
+                values[k] = sum(p * v for p, v in zip(posterior, sub))
+            elif node['type'] == 'n':
+                values[k] = sum(p * v for p, v in zip(node['probabilities'], sub))
+            else:
+                values[k] = max(sub)
+        signals.append((p_signal, values[0]))
+        value += p_signal * values[0]
+    return {'base': base, 'value': value, 'voi': value - base, 'signals': signals}
+
+
+def evpi(tree, nodes):
+    """Expected value of perfect information about nodes, see value_of_information"""
+    return value_of_information(tree, nodes)['voi']
+
+
+def evsi(tree, nodes, likelihood):
+    """Expected value of sample information about nodes, see value_of_information"""
+    return value_of_information(tree, nodes, likelihood)['voi']
+
+
+def evpi_all(tree):
+    """ EVPI of every nature node on its own
+
+        return: dictionary of nature node index to its EVPI
+    """
+    return {k: evpi(tree, k) for k, node in enumerate(tree) if node['type'] == 'n'}
+
+
+def show_evpi(tree):
+    """Prints the value of perfect information about every nature node"""
+    strategy, tree = resolve(tree)
+    print('ev = {}'.format(tree[0]['subvalue']))
+    for k, value in evpi_all(tree).items():
+        print('{} {} evpi = {}'.format(k, tree[k]['name'], value))
+
+
 def see(strategy, tree):
     tree = calc_values(strategy, tree)
     show_computed_values(tree, 0, 0)
@@ -525,11 +1644,93 @@ def help():
     print("       c.  type 'play' to play the strategy once.")
     print("       d.  type 'sim' to simulate a number of plays of the strategy")
     print("       e.  type 'value' to calculate the expected value of a strategy")
+    print("       f.  type 'exact' to get the exact payoff distribution of the strategy")
+    print("       g.  type 'evpi' to see what knowing each nature node's outcome is worth")
+    print()
+    print("   4.  Type 'stats' to start recording the time and work of load, solve,")
+    print("       calc and sim, and type it again to see what was recorded.")
     print()
     print("   Future Relaese will allow an agent to play the tree. ")
     print("       ")
 
 
+#  Instrumentation.  While STATS holds a Stats object, load_tree, solve,
+#  calc_values, resolve and sim_decisions add their wall time and the work they
+#  did to it.  Each of them checks STATS once per call, never per node or per
+#  trial, so when it is None (the default) they run as before.
+
+STATS = None  # the Stats being recorded, None when instrumentation is off
+
+
+class Stats:
+    """ Wall time and work counters of load, solve, calc, resolve and sim
+
+        phases: dictionary of phase name to a dictionary of totals, 'calls' and
+                'seconds' plus counters such as 'nodes', 'sweeps', 'draws' and
+                'trials'
+    """
+
+    rated = ('nodes', 'lines', 'trials', 'draws')  # counters reported per second
+
+    def __init__(self):
+        self.phases = OrderedDict()
+
+    def record(self, phase, seconds, **counts):
+        """Adds one call of phase that took seconds and did counts of work"""
+        totals = self.phases.get(phase)
+        if totals is None:
+            totals = self.phases[phase] = OrderedDict([('calls', 0), ('seconds', 0.0)])
+        totals['calls'] += 1
+        totals['seconds'] += seconds
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+
+    def rate(self, phase, counter):
+        """Returns counter per second over all calls of phase (None if not timed)"""
+        totals = self.phases.get(phase)
+        if not totals or totals['seconds'] <= 0:
+            return None
+        return totals.get(counter, 0) / totals['seconds']
+
+    def reset(self):
+        self.phases.clear()
+
+    def as_dict(self):
+        return {phase: dict(totals) for phase, totals in self.phases.items()}
+
+    def report(self, file = None):
+        """Prints one line per phase with its totals and rates"""
+        if file is None:
+            file = sys.stdout
+        if not self.phases:
+            print('no statistics recorded yet', file=file)
+        for phase, totals in self.phases.items():
+            parts = ['{:<8} calls {:>6} {:>10.4f} s'.format(phase, totals['calls'], totals['seconds'])]
+            for key, value in totals.items():
+                if key in ('calls', 'seconds'):
+                    continue
+                rate = self.rate(phase, key) if key in self.rated else None
+                if rate is None:
+                    parts.append('{} {:,}'.format(key, value))
+                else:
+                    parts.append('{} {:,} ({:,.0f}/s)'.format(key, value, rate))
+            print('  '.join(parts), file=file)
+
+
+def enable_stats(stats = None):
+    """Starts recording into stats (a new Stats if None) and returns it"""
+    global STATS
+    STATS = Stats() if stats is None else stats
+    return STATS
+
+
+def disable_stats():
+    """Stops recording and returns the Stats that was being recorded"""
+    global STATS
+    stats, STATS = STATS, None
+    return stats
+
+
 def check_all_descendants_used(node, tree):
     """Check to make sure all descendants have bben used
 
@@ -568,65 +1769,1565 @@ def calc_max_value(node, tree):
     return choice, float(v)
 
 
-def solve(tree):
+class TreeIndex:
+    """ Structure of a tree, built once in linear time by get_index
+
+        parent:     array with the index of the node that branches to each node (-1 for roots)
+        depth:      array with the number of steps from the root to each node
+        offsets:    array of len(tree) + 1 positions into children
+        children:   array of descendants, those of node k are children[offsets[k]:offsets[k + 1]]
+        size:       array with the number of nodes in the subtree below and including each node
+        pre_order:  array of node indexes, every node before its descendants
+        post_order: array of node indexes, every node after its descendants
+        terminals:  array of the indexes of the terminal nodes
+        fingerprint: see structure_fingerprint
+
+        Nodes that can not be reached from node 0 are indexed as the roots of
+        their own subtrees.  In a dag (see dedupe_tree) a shared node's parent is
+        the first node found to branch to it and size counts shared nodes once
+        for every time they are reached.
+    """
+
+    def __init__(self, tree):
+        n = len(tree)
+        self.offsets = offsets = array('q', [0])
+        self.children = children = array('q')
+        self.terminals = array('q')
+        for k, node in enumerate(tree):
+            if node['type'] == 't':
+                self.terminals.append(k)
+            else:
+                children.extend(node['descendants'])
+            offsets.append(len(children))
+        self.fingerprint = structure_fingerprint(tree)
+
+        self.parent = parent = array('q', [-1]) * n
+        self.depth = depth = array('q', [0]) * n
+        self.size = size = array('q', [1]) * n
+        self.pre_order = array('q')
+        self.post_order = array('q')
+        seen = bytearray(n)
+        for root in range(n):
+            if seen[root]:
+                continue
+            seen[root] = 1
+            self.pre_order.append(root)
+            stack = [root]
+            edge = [offsets[root]]
+            while stack:
+                k = stack[-1]
+                e = edge[-1]
+                if e < offsets[k + 1]:
+                    edge[-1] = e + 1
+                    j = children[e]
+                    if not seen[j]:
+                        seen[j] = 1
+                        parent[j] = k
+                        depth[j] = depth[k] + 1
+                        self.pre_order.append(j)
+                        stack.append(j)
+                        edge.append(offsets[j])
+                else:
+                    stack.pop()
+                    edge.pop()
+                    self.post_order.append(k)
+                    for e in range(offsets[k], offsets[k + 1]):
+                        size[k] += size[children[e]]
+
+    def __len__(self):
+        return len(self.parent)
+
+    def descendants(self, node_index):
+        """The descendants of a node as a slice of children"""
+        return self.children[self.offsets[node_index]:self.offsets[node_index + 1]]
+
+
+def get_index(tree):
+    """ Returns the TreeIndex of a tree, building it if needed
+
+        The index is kept on the root node under 'index'.  It is rebuilt when the
+        number of nodes changes.  solve and calc_values also drop it (with the
+        'checked' mark) when structure_changed finds other edits to 'descendants';
+        code that rewires them and uses the index otherwise must call invalidate_index.
+    """
+    index = tree[0].get('index')
+    if index is None or len(index) != len(tree):
+        index = TreeIndex(tree)
+        tree[0]['index'] = index
+    return index
+
+
+def invalidate_index(tree):
+    """Drops the TreeIndex of a tree after its structure has changed"""
+    if tree:
+        tree[0].pop('index', None)
+        tree[0].pop('checked', None)
+
+
+def structure_fingerprint(tree):
+    """ Number and sum of the descendants of all nodes, kept by TreeIndex
+
+        return: (edges, total), or None if some descendants are not numbers
+    """
+    descendants = [node['descendants'] for node in tree if 'descendants' in node]
+    try:
+        return sum(map(len, descendants)), sum(map(sum, descendants))
+    except TypeError:
+        return None
+
+
+def structure_changed(tree):
+    """ True if the descendants of the nodes no longer match the TreeIndex kept on
+        the root.  They are compared by structure_fingerprint, which is much
+        cheaper than building a new index
+    """
+    index = tree[0].get('index')
+    if index is None:
+        return False
+    return len(index) != len(tree) or structure_fingerprint(tree) != index.fingerprint
+
+
+def get_post_order(tree):
+    """ Orders the nodes so every descendant comes before its ancestor
+
+        args: tree, a list of dictionary nodes
+        return: order, array of node indexes from the tree's TreeIndex
+    """
+    return get_index(tree).post_order
+
+
+#  Objectives for solve.  An objective describes what backward induction
+#  carries up the tree for every node (its state):
+#
+#      terminal(pay)           state of a terminal node
+#      nature(states, probs)   state of a nature node from its descendants' states
+#      value(state)            number compared at decision nodes and stored as 'subvalue'
+
+
+class ExpectedUtility:
+    """ Maximize the expected utility of the payoff
+
+        utility, function applied to the payoff of every terminal node
+        inverse, inverse of utility.  If given, 'subvalue' holds the certainty
+                 equivalent instead of the expected utility
+    """
+
+    def __init__(self, utility, inverse = None):
+        self.utility = utility
+        self.inverse = inverse
+
+    def terminal(self, pay):
+        return float(self.utility(pay))
+
+    def nature(self, states, probs):
+        v = 0.0
+        for j, state in enumerate(states):
+            v += state * probs[j]
+        return v
+
+    def value(self, state):
+        if self.inverse is None:
+            return state
+        return float(self.inverse(state))
+
+
+class CVaR:
+    """ Maximize the conditional value at risk: the expected payoff in the worst
+        alpha share of outcomes.
+
+        CVaR is not time consistent: the best choice at a decision node can depend
+        on the rest of the tree, so comparing the CVaR of descendants does not find
+        the best strategy.  solve_cvar uses the Rockafellar-Uryasev form
+
+            CVaR(X) = max over eta of  eta - E[(eta - X)+] / alpha
+
+        For a fixed eta the inner problem is ExpectedUtility with the utility
+        -(eta - pay)+, which backward induction solves, and the best eta is one of
+        the terminal payoffs.  solve_cvar searches those payoffs for it.
+    """
+
+    def __init__(self, alpha):
+        if not 0.0 < alpha <= 1.0:
+            raise ValueError('alpha must be in (0, 1]')
+        self.alpha = alpha
+
+    def utility(self, eta):
+        """The ExpectedUtility solved for one value of eta"""
+        return ExpectedUtility(lambda pay: -max(eta - pay, 0.0))
+
+    def value(self, eta, expected_utility):
+        """eta - E[(eta - X)+] / alpha from the expected utility of self.utility(eta)"""
+        return eta + expected_utility / self.alpha
+
+
+def solve(tree, objective = None):
     """ Uses backward induction to find the strategy in tree that maximizes expected value
 
         args: tree, a list of dictioanries
+              objective, None to maximize expected value, or an objective such as
+                         ExpectedUtility or CVaR
         return: strategy, a list of choices at decision nodes
                 tree, updated tree with completed subvalue at every node
 
         tree[0]['subvalue'] contains the expected value of the optimal strategy
+        (or the objective's value of it)
     """
-    # initialize tree for backwards induction
-    strategy = []
-    for node in tree:
-        if node['type'] == 't':
+    if tree:
+        if structure_changed(tree):
+            invalidate_index(tree)
+        recheck_tree(tree)
+    if isinstance(objective, CVaR):
+        return solve_cvar(tree, objective)
+    if objective is not None:
+        return solve_objective(tree, objective)
+    start = time.perf_counter()
+    strategy = None
+    visited = 0
+    if SOLVE_CACHE is not None:
+        key = tree_key(tree)
+        strategy = SOLVE_CACHE.load(key, tree)
+    if strategy is None:
+        strategy = [-1] * len(tree)  # default all to terminal
+
+        # every node is visited once, after all of its descendants
+        order = get_post_order(tree)
+        for index in order:
+            node = tree[index]
+            if node['type'] == 't':
+                node['subvalue'] = float(node['pay'])
+            elif node['type'] == 'n':
+                node['subvalue'] = float(calc_expected_value(node, tree))
+            elif node['type'] == 'd':
+                choice, mv = calc_max_value(node, tree)
+                node['subvalue'] = float(mv)
+                strategy[index] = choice
             node['used'] = True
-            node['subvalue'] = float(node['pay'])
-        else:
-            node['used'] = False
-            node['subvalue'] = 0.0
-        strategy.append(-1)  # default all to terminal
+        visited = len(order)
+        if SOLVE_CACHE is not None:
+            SOLVE_CACHE.store(key, strategy, tree)
+    build_samplers(tree)
+    tree[0]['solved'] = True
+    tree[0]['strategy'] = strategy
+    tree[0].pop('dirty', None)
+    if STATS is not None:
+        STATS.record('solve', time.perf_counter() - start, nodes=visited,
+                     sweeps=int(visited > 0), cache_hits=int(visited == 0))
+    return strategy, tree
 
-    # solve for optimal strategy
-    while not tree[0]['used']:
-        for index, node in enumerate(tree):
-            if not node['used']:
-                if check_all_descendants_used(node, tree):
-                    if node['type'] == 'n':
-                        ev = calc_expected_value(node, tree)
-                        node['used'] = True
-                        node['subvalue'] = float(ev)
-                    elif node['type'] == 'd':
-                        choice, mv = calc_max_value(node, tree)
-                        node['used'] = True
-                        node['subvalue'] = float(mv)
-                        strategy[index] = choice
+
+def solve_objective(tree, objective):
+    """ Used by solve to maximize an objective other than expected value
+
+        args: tree, a list of dictioanries
+              objective, an objective such as ExpectedUtility or CVaR
+        return: strategy, tree
+    """
+    start = time.perf_counter()
+    strategy = [-1] * len(tree)
+    states = [None] * len(tree)
+    # number of ancestors still to use a state, so states can be dropped early
+    waiting = [0] * len(tree)
+    for k in get_index(tree).children:
+        waiting[k] += 1
+
+    order = get_post_order(tree)
+    for index in order:
+        node = tree[index]
+        if node['type'] == 't':
+            state = objective.terminal(float(node['pay']))
+        elif node['type'] == 'n':
+            state = objective.nature([states[k] for k in node['descendants']],
+                                     node['probabilities'])
+        elif node['type'] == 'd':
+            choice = node['descendants'][0]
+            for k in node['descendants']:
+                if tree[k]['subvalue'] > tree[choice]['subvalue']:
+                    choice = k
+            state = states[choice]
+            strategy[index] = choice
+        states[index] = state
+        node['subvalue'] = objective.value(state)
+        node['used'] = True
+        for k in node.get('descendants', ()):
+            waiting[k] -= 1
+            if waiting[k] == 0:
+                states[k] = None
+    build_samplers(tree)
+    tree[0]['solved'] = False  # resolve only updates expected values
+    if STATS is not None:
+        STATS.record('solve', time.perf_counter() - start, nodes=len(order), sweeps=1)
     return strategy, tree
 
 
-def calc_values(strategy, tree):
+CVAR_ROUND = 32  # values of eta evaluated together in each round of solve_cvar
+CVAR_BATCH_BYTES = 64 << 20  # memory solve_scenarios may use for the etas of one batch
+
+
+def solve_cvar(tree, objective):
+    """ Used by solve to maximize CVaR, see CVaR
+
+        The best eta is one of the terminal payoffs.  g(eta) = eta - min E[(eta - X)+] / alpha
+        has a slope between 1 - 1 / alpha and 1, so the values of g at a few etas
+        bound it everywhere between them.  The etas are evaluated CVAR_ROUND at a
+        time, starting with an even grid, and each round only the etas whose bound
+        beats the best value so far are kept, so the result is exact but usually
+        only a small share of the payoffs is evaluated.
+
+        args: tree, a list of dictioanries
+              objective, a CVaR
+        return: strategy, tree with 'subvalue' holding eta - E[(eta - payoff)+] / alpha
+                for the best eta at every node.  At the root it is the CVaR of strategy
+    """
+    if not tree:
+        return [], tree
+    etas = sorted(set(float(node['pay']) for node in tree if node['type'] == 't'))
+    if not etas:
+        raise ValueError('CVaR needs a tree with terminal nodes')
+    start = time.perf_counter()
+    slope = 1.0 / objective.alpha - 1.0  # how fast g may fall as eta grows
+    compiled = compile_tree(tree) if np is not None else None
+    found = {}  # index in etas to g
+    live = [(0, len(etas))]  # ranges of indexes in etas that may hold the best
+    best = None
+    while live:
+        total = sum(end - begin for begin, end in live)
+        picks = []
+        for j in range(min(CVAR_ROUND, total)):
+            position = (2 * j + 1) * total // (2 * min(CVAR_ROUND, total))
+            for begin, end in live:
+                if position < end - begin:
+                    picks.append(begin + position)
+                    break
+                position -= end - begin
+        if not found:  # include the ends so every eta lies between two found ones
+            picks = sorted(set(picks) | {0, len(etas) - 1})
+        for k, value in zip(picks, cvar_values(tree, compiled, objective, [etas[k] for k in picks])):
+            found[k] = value
+            if best is None or value > found[best] or (value == found[best] and k < best):
+                best = k
+        live = []
+        known = sorted(found)
+        for a, b in zip(known, known[1:]):
+            # g(x) <= g(a) + (x - a) and g(x) <= g(b) + (b - x) * slope
+            low = etas[a] + found[best] - found[a]
+            begin = bisect.bisect_right(etas, low, a + 1, b)
+            end = b
+            if slope > 0.0:
+                high = etas[b] - (found[best] - found[b]) / slope
+                end = bisect.bisect_left(etas, high, begin, b)
+            else:
+                end = begin if found[b] <= found[best] else b
+            if begin < end:
+                live.append((begin, end))
+    if STATS is not None:
+        STATS.record('cvar', time.perf_counter() - start, etas=len(found), candidates=len(etas))
+    eta = etas[best]
+    strategy, tree = solve_objective(tree, objective.utility(eta))
     for node in tree:
-        if node['type'] == 't':
+        node['subvalue'] = objective.value(eta, node['subvalue'])
+    return strategy, tree
+
+
+def cvar_values(tree, compiled, objective, etas):
+    """ Used by solve_cvar to find eta - max E[-(eta - X)+] / alpha for each of etas
+
+        With compiled, the CompiledTree of tree, all etas are solved together as
+        scenarios of solve_scenarios, in batches of at most CVAR_BATCH_BYTES.
+        Without it (no numpy) they are solved one after the other.
+    """
+    if compiled is None:
+        return [objective.value(eta, solve_objective(tree, objective.utility(eta))[1][0]['subvalue'])
+                for eta in etas]
+    pay = np.frombuffer(compiled.pay, dtype=np.float64)[compiled.terminals()]
+    # solve_scenarios keeps values, probabilities and strategies for every scenario
+    batch = max(1, CVAR_BATCH_BYTES // (24 * (len(compiled) + len(compiled.children))))
+    values = []
+    for k in range(0, len(etas), batch):
+        column = np.asarray(etas[k:k + batch], dtype=np.float64)[:, None]
+        root = solve_scenarios(compiled, pays=np.minimum(pay - column, 0.0))[0]
+        values.extend(column[:, 0] + root / objective.alpha)
+    return [float(v) for v in values]
+
+
+def calc_values(strategy, tree):
+    """ Uses backward induction to find the value of every node when strategy is played
+
+        args: strategy, a list of choices at decision nodes
+              tree, a list of dictionaries
+        return: tree, updated tree with completed subvalue at every node
+    """
+    start = time.perf_counter()
+    visited = 0
+    if tree and structure_changed(tree):
+        invalidate_index(tree)
+    if SOLVE_CACHE is not None:
+        key = tree_key(tree, strategy)
+    if SOLVE_CACHE is None or SOLVE_CACHE.load(key, tree) is None:
+        order = get_post_order(tree)
+        for index in order:
+            node = tree[index]
+            if node['type'] == 't':
+                node['subvalue'] = float(node['pay'])
+            elif node['type'] == 'n':
+                node['subvalue'] = float(calc_expected_value(node, tree))
+            elif node['type'] == 'd':
+                node['subvalue'] = tree[strategy[index]]['subvalue']
             node['used'] = True
-            node['subvalue'] = float(node['pay'])
+        visited = len(order)
+        if SOLVE_CACHE is not None:
+            SOLVE_CACHE.store(key, strategy, tree)
+    tree[0]['solved'] = False
+    if STATS is not None:
+        STATS.record('calc', time.perf_counter() - start, nodes=visited,
+                     sweeps=int(visited > 0), cache_hits=int(visited == 0))
+    return tree
+
+
+def mark_dirty(tree, node_index):
+    """Records that the payoff or probabilities of a node were edited since the last solve"""
+    tree[0].setdefault('dirty', set()).add(node_index)
+
+
+def resolve(tree):
+    """ Brings a solved tree up to date after edits, see mark_dirty
+
+        Only the edited nodes and their ancestors are recomputed, and the walk up
+        from an edited node stops at the first node whose value did not change.
+        If the tree has not been solved (or calc_values has been run since) it
+        falls back to solve.
+
+        args: tree, a list of dictioanries
+        return: strategy, a list of choices at decision nodes (kept on the root
+                          node under 'strategy', so do not change it in place)
+                tree, updated tree with completed subvalue at every node
+    """
+    root = tree[0]
+    recheck_tree(tree)
+    strategy = root.get('strategy')
+    if not root.get('solved') or strategy is None or len(strategy) != len(tree):
+        return solve(tree)
+    start = time.perf_counter()
+    parent = get_index(tree).parent
+    dirty = sorted(root.pop('dirty', ()), reverse=True)
+    visited = 0
+    for index in dirty:
+        if tree[index]['type'] == 'n':
+            tree[index]['alias'] = make_alias_table(tree[index]['probabilities'])
+        k = index
+        while k != -1:
+            visited += 1
+            node = tree[k]
+            old = node['subvalue']
+            if node['type'] == 't':
+                node['subvalue'] = float(node['pay'])
+            elif node['type'] == 'n':
+                node['subvalue'] = float(calc_expected_value(node, tree))
+            elif node['type'] == 'd':
+                strategy[k], node['subvalue'] = calc_max_value(node, tree)
+            if node['subvalue'] == old:
+                break  # nothing above this node can change
+            k = parent[k]
+    if STATS is not None:
+        STATS.record('resolve', time.perf_counter() - start, nodes=visited, dirty=len(dirty))
+    return strategy, tree
+
+
+#  Solve cache.  While SOLVE_CACHE holds a SolveCache, solve and calc_values
+#  look the tree up by tree_key before doing any induction and store what they
+#  computed after a miss.  The cache is a directory with one file per result:
+#
+#      strategy  int64[n]    subvalue  float64[n]
+#
+#  The least recently used files are removed when the directory grows past
+#  max_bytes.  Names of nodes are not part of the key, so trees that differ
+#  only in their names share an entry.
+
+CACHE_EXTENSION = '.dtc'
+CACHE_MAX_BYTES = 256 << 20
+
+SOLVE_CACHE = None  # the SolveCache used by solve and calc_values, None when off
+
+
+def tree_key(tree, strategy = None):
+    """ Canonical content hash of a tree: its structure, payoffs and probabilities
+
+        args: tree, a list of dictionary nodes
+              strategy, if given it is hashed too (the key of calc_values)
+        return: string of hexadecimal digits
+    """
+    index = get_index(tree)
+    digest = hashlib.sha256()
+    digest.update(''.join([node['type'] for node in tree]).encode())
+    digest.update(index.offsets.tobytes())
+    digest.update(index.children.tobytes())
+    digest.update(array('d', [float(node['pay']) for node in tree
+                              if node['type'] == 't']).tobytes())
+    digest.update(array('d', [p for node in tree if node['type'] == 'n'
+                              for p in node['probabilities']]).tobytes())
+    if strategy is not None:
+        digest.update(b'strategy')
+        digest.update(array('q', strategy).tobytes())
+    return digest.hexdigest()
+
+
+class SolveCache:
+    """ Strategies and subvalues kept on disk under the tree_key of their tree
+
+        directory: where the cache files are kept
+        max_bytes: size of the directory above which old entries are removed
+        hits, misses: number of lookups of each kind since the cache was made
+        size:      running total of the bytes in the directory, None until the
+                   first scan; store adds to it and only scans the directory
+                   (in evict) when it passes max_bytes, so files written by
+                   other processes are counted at the next eviction
+    """
+
+    def __init__(self, directory, max_bytes = CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = None
+        os.makedirs(directory, exist_ok=True)
+
+    def file_name(self, key):
+        return os.path.join(self.directory, key + CACHE_EXTENSION)
+
+    def load(self, key, tree):
+        """ Copies a cached result into tree
+
+            return: strategy, a list of choices at decision nodes, or None if
+                    key is not in the cache (tree is then left alone)
+        """
+        n = len(tree)
+        name = self.file_name(key)
+        try:
+            with open(name, 'rb') as file:
+                data = file.read()
+        except OSError:
+            data = b''
+        if len(data) != 16 * n:  # missing, or damaged by a crash while writing
+            self.misses += 1
+            return None
+        try:
+            os.utime(name)  # the file's time is its place in the LRU order
+        except OSError:
+            pass  # removed by another process in the meantime
+        strategy = array('q')
+        strategy.frombytes(data[:8 * n])
+        values = array('d')
+        values.frombytes(data[8 * n:])
+        for node, value in zip(tree, values):
+            node['subvalue'] = value
+            node['used'] = True
+        self.hits += 1
+        return strategy.tolist()
+
+    def store(self, key, strategy, tree):
+        """Saves strategy and the subvalues of tree under key, then evicts if needed"""
+        name = self.file_name(key)
+        try:
+            old_size = os.stat(name).st_size
+        except OSError:
+            old_size = 0
+        temp_name = '{}.{}.tmp'.format(name, os.getpid())
+        with open(temp_name, 'wb') as file:
+            file.write(array('q', strategy).tobytes())
+            file.write(array('d', [node['subvalue'] for node in tree]).tobytes())
+        os.replace(temp_name, name)  # readers never see half a file
+        if self.size is not None:
+            self.size += 16 * len(tree) - old_size
+        if self.size is None or self.size > self.max_bytes:
+            self.evict(self.max_bytes * 3 // 4)  # room for many stores before the next scan
+
+    def evict(self, target = None):
+        """ Removes the least recently used files until the cache fits in target
+
+            target: bytes to shrink to, max_bytes if None
+            return: size, the bytes left in the directory
+        """
+        if target is None:
+            target = self.max_bytes
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(CACHE_EXTENSION):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for mtime, size, name in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+            total -= size
+        self.size = total
+        return total
+
+    def clear(self):
+        """Removes every entry"""
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(CACHE_EXTENSION):
+                os.remove(entry.path)
+        self.size = 0
+
+
+def enable_cache(directory, max_bytes = CACHE_MAX_BYTES):
+    """Makes solve and calc_values use a SolveCache in directory and returns it"""
+    global SOLVE_CACHE
+    SOLVE_CACHE = SolveCache(directory, max_bytes)
+    return SOLVE_CACHE
+
+
+def disable_cache():
+    """Stops using the solve cache and returns it"""
+    global SOLVE_CACHE
+    cache, SOLVE_CACHE = SOLVE_CACHE, None
+    return cache
+
+
+#  Shared subtrees.  dedupe_tree hash-conses a tree: nodes are keyed bottom up by
+#  type, payoff, probabilities and the keys of their descendants, and equal keys
+#  become one node.  The result (a dag) is a list of dictionary nodes like a tree
+#  except that a node can be a descendant of several nodes.  get_post_order visits
+#  every node once, so solve and calc_values compute each shared node one time.
+#  A node's 'ancestor' in a dag is only the first node found to branch to it, so
+#  use expand_tree before edit/resolve, which follow 'ancestor'.
+
+def dedupe_tree(tree, match_names = False):
+    """ Collapses identical subtrees into shared nodes
+
+        args: tree, a list of dictionary nodes
+              match_names, if True only subtrees whose node names match too are
+                           shared.  By default names are ignored and a shared
+                           node keeps the first name found
+        return: dag, list of dictionary nodes with shared descendants
+                mapping, list with the dag index of every node in tree
+                         (-1 for nodes that can not be reached from the root)
+                names, the names of the nodes of tree in the order expand_tree
+                       makes them, so expand_tree(dag, names=names) gives them back
+    """
+    keys = {}
+    canonical = [-1] * len(tree)
+    unique = []
+    for index in get_post_order(tree):
+        node = tree[index]
+        name = node['name'] if match_names else None
+        if node['type'] == 't':
+            key = ('t', name, float(node['pay']))
+        else:
+            descendants = tuple(canonical[k] for k in node['descendants'])
+            if node['type'] == 'n':
+                key = ('n', name, descendants, tuple(node['probabilities']))
+            else:
+                key = (node['type'], name, descendants)
+        if key not in keys:
+            keys[key] = len(unique)
+            unique.append((index, descendants if node['type'] != 't' else ()))
+        canonical[index] = keys[key]
+
+    # number the dag breadth first so the root is node 0
+    number = [-1] * len(unique)
+    number[canonical[0]] = 0
+    order = [canonical[0]]
+    dag = []
+    for u in order:
+        index, descendants = unique[u]
+        node = {'name': tree[index]['name'], 'type': tree[index]['type']}
+        if node['type'] == 't':
+            node['pay'] = float(tree[index]['pay'])
         else:
-            node['used'] = False
-            node['subvalue'] = 0.0
+            for c in descendants:
+                if number[c] == -1:
+                    number[c] = len(order)
+                    order.append(c)
+            node['descendants'] = [number[c] for c in descendants]
+            if node['type'] == 'n':
+                node['probabilities'] = list(tree[index]['probabilities'])
+        dag.append(node)
+    get_ancestory(dag)
+    mapping = [number[c] if c != -1 else -1 for c in canonical]
+    # expand_tree copies the nodes breadth first, the order of this walk of tree
+    order = [0]
+    for index in order:
+        order.extend(tree[index].get('descendants', ()))
+    names = [tree[index]['name'] for index in order]
+    return build_samplers(dag), mapping, names
+
+
+def expand_tree(dag, strategy = None, names = None):
+    """ Copies every shared node of a dag so the result is a plain tree again
+
+        args: dag, list of dictionary nodes from dedupe_tree
+              strategy, optional strategy for the dag, e.g. from solve(dag)
+              names, optional names of the tree nodes from dedupe_tree.  Without
+                     them every copy of a shared node has the shared node's name
+        return: strategy, the same choices as tree indexes (None if no strategy given)
+                tree, a list of dictionary nodes where each node has one ancestor
+    """
+    tree = [{'ancestor': -1}]
+    source = [0]  # dag index of every tree node, extended as nodes are copied
+    choices = None if strategy is None else [-1]
+    index = 0
+    while index < len(source):
+        node = dag[source[index]]
+        copy = tree[index]
+        copy['name'] = node['name'] if names is None else names[index]
+        copy['type'] = node['type']
+        for key in ('pay', 'subvalue', 'used'):
+            if key in node:
+                copy[key] = node[key]
+        if node['type'] != 't':
+            if node['type'] == 'n':
+                copy['probabilities'] = list(node['probabilities'])
+            copy['descendants'] = []
+            for j in node['descendants']:
+                if choices is not None:
+                    if strategy[source[index]] == j and choices[index] == -1:
+                        choices[index] = len(tree)
+                    choices.append(-1)
+                copy['descendants'].append(len(tree))
+                tree.append({'ancestor': index})
+                source.append(j)
+        index += 1
+    return choices, build_samplers(tree)
+
+
+#  Lazy trees.  A LazyTree is defined by a rule that expands a state into a node
+#  instead of a list of nodes.  Its nodes look like the nodes of a tree with
+#  states in place of node indexes, so play(strategy, lazy, lazy.root) and
+#  path(strategy, lazy, lazy.root) work on it directly, with strategy the
+#  dictionary returned by solve_lazy.  Only the states that are visited are
+#  expanded, and expanded nodes and solved values are kept in bounded LRU caches.
+
+class LazyTree:
+    """ A tree whose nodes are made on demand
+
+        expand, function from a state to a node dictionary with 'name' and 'type' and
+                'pay' for terminal nodes, or 'descendants' (a list of states) and for
+                nature nodes 'probabilities'.  States must be hashable.
+        root, the state of the root node
+        cache_size, largest number of expanded nodes and of values to remember.
+                    Values that are dropped are solved again when needed, so
+                    solving is fastest when the distinct states fit in the cache.
+    """
 
-    while not tree[0]['used']:
-        for index, node in enumerate(tree):
-            if not node['used']:
-                if check_all_descendants_used(node, tree):
-                    if node['type'] == 'n':
-                        ev = calc_expected_value(node, tree)
-                        node['used'] = True
-                        node['subvalue'] = float(ev)
-                    elif node['type'] == 'd':
-                        node['used'] = True
-                        choice = strategy[index]
-                        node['subvalue'] = tree[choice]['subvalue']
-    return tree
+    def __init__(self, expand, root, cache_size = 100000):
+        self.expand = expand
+        self.root = root
+        self.cache_size = cache_size
+        self.nodes = OrderedDict()
+        self.values = OrderedDict()
+        self.expansions = 0
+
+    @classmethod
+    def from_tree(cls, tree, cache_size = 100000):
+        """A LazyTree over a list of dictionary nodes, the states are the node indexes"""
+        return cls(tree.__getitem__, 0, cache_size)
+
+    def __getitem__(self, state):
+        node = self.nodes.get(state)
+        if node is None:
+            node = self.expand(state)
+            self.expansions += 1
+            self.remember(self.nodes, state, node)
+        else:
+            self.nodes.move_to_end(state)
+        return node
+
+    def remember(self, cache, state, value):
+        """Adds to an LRU cache, dropping the least recently used entry when full"""
+        cache[state] = value
+        cache.move_to_end(state)
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def solved(self, state):
+        """ (value, choice) kept by solve_lazy for state, or None if it is not in
+            the cache.  choice is the chosen descendant of a decision node, else None
+        """
+        entry = self.values.get(state)
+        if entry is not None:
+            self.values.move_to_end(state)
+        return entry
+
+    def value(self, state):
+        """Solved value of state, or None if it is not in the cache"""
+        entry = self.solved(state)
+        return None if entry is None else entry[0]
+
+
+def solve_lazy(lazy, state = None):
+    """ Backward induction on a LazyTree, expanding only reachable states once each
+        (as long as they stay in the cache)
+
+        args: lazy, a LazyTree
+              state, state to solve from (default the root)
+        return: strategy, dictionary from every decision state reachable from state
+                          to the chosen descendant state
+                value, expected value of the optimal strategy
+    """
+    if state is None:
+        state = lazy.root
+    value = lazy.value(state)
+    if value is None:
+        value = solve_lazy_values(lazy, state)
+    # the choices are kept with the values, so states solved by an earlier call
+    # are in the strategy too
+    strategy = {}
+    seen = {state}
+    stack = [state]
+    while stack:
+        current = stack.pop()
+        node = lazy[current]
+        if node['type'] == 't':
+            continue
+        if node['type'] == 'd':
+            entry = lazy.solved(current)
+            if entry is None:  # dropped from the cache since it was solved
+                solve_lazy_values(lazy, current)
+                entry = lazy.solved(current)
+            strategy[current] = entry[1]
+        for child in node['descendants']:
+            if child not in seen:
+                seen.add(child)
+                stack.append(child)
+    return strategy, value
+
+
+def solve_lazy_values(lazy, state):
+    """ Used by solve_lazy to solve the states below state that are not in the cache
+
+        Every solved state is kept in lazy.values as (value, choice).
+        return: value, expected value of the optimal strategy from state
+    """
+    cached = lazy.value(state)
+    if cached is not None:
+        return cached
+    # each frame is [state, node, next descendant, value so far, choice so far]
+    stack = [[state, lazy[state], 0, 0.0, None]]
+    on_stack = {state}
+    result = None
+    while stack:
+        frame = stack[-1]
+        node = frame[1]
+        if node['type'] == 't':
+            v = float(node['pay'])
+        elif frame[2] < len(node['descendants']):
+            child = node['descendants'][frame[2]]
+            v = lazy.value(child)
+            if v is None:
+                if child in on_stack:
+                    raise ValueError('state {} is its own descendant'.format(child))
+                stack.append([child, lazy[child], 0, 0.0, None])
+                on_stack.add(child)
+                continue
+            combine_lazy(frame, v)
+            continue
+        else:
+            v = frame[3]
+        stack.pop()
+        on_stack.discard(frame[0])
+        lazy.remember(lazy.values, frame[0], (v, frame[4]))
+        if stack:
+            combine_lazy(stack[-1], v)
+        else:
+            result = v
+    return result
+
+
+def combine_lazy(frame, v):
+    """Used by solve_lazy to fold the value v of the next descendant into frame"""
+    state, node, k, value, choice = frame
+    if node['type'] == 'n':
+        frame[3] = value + v * node['probabilities'][k]
+    elif choice is None or v > value:
+        frame[3] = v
+        frame[4] = node['descendants'][k]
+    frame[2] = k + 1
+
+
+#  Sampling solver.  solve_mcts estimates the best strategy of a tree too big to
+#  solve with Monte Carlo tree search.  Every sample walks down from the root:
+#  nature nodes are sampled as in play, decision nodes pick a descendant by
+#  UCB1, and at the first state that has not been sampled before the rest of
+#  the walk is a play with random decisions (a rollout).  The payoff reached is
+#  added to every state on the walk.  Only sampled states are expanded, so it
+#  works on a LazyTree of any size.
+
+MCTS_SAMPLES = 10000  # search samples when neither samples nor time_limit is given
+
+
+class RolloutPolicy:
+    """ A strategy for play: follows strategy where it has a choice and picks a
+        random descendant at every other decision node
+
+        tree: LazyTree or list of dictionary nodes whose nodes are looked up
+        strategy: dictionary from decision state to descendant state
+    """
+
+    def __init__(self, tree, strategy = None, rng = random):
+        self.tree = tree
+        self.strategy = {} if strategy is None else strategy
+        self.rng = rng
+
+    def __getitem__(self, state):
+        choice = self.strategy.get(state)
+        if choice is None:
+            descendants = self.tree[state]['descendants']
+            choice = descendants[int(self.rng.random() * len(descendants))]
+        return choice
+
+
+def choose_ucb(descendants, visits, totals, parent_visits, scale, rng = random):
+    """ Used by solve_mcts to pick the descendant of a decision node to sample
+
+        Descendants never sampled come first, then the one with the highest mean
+        payoff plus scale * sqrt(ln(parent_visits) / visits).
+    """
+    unvisited = [s for s in descendants if s not in visits]
+    if unvisited:
+        return unvisited[int(rng.random() * len(unvisited))]
+    log_n = math.log(parent_visits)
+    best = None
+    best_score = None
+    for s in descendants:
+        n = visits[s]
+        score = totals[s] / n + scale * math.sqrt(log_n / n)
+        if best is None or score > best_score:
+            best = s
+            best_score = score
+    return best
+
+
+def solve_mcts(tree, samples = None, time_limit = None, rollouts = 1000, exploration = 1.0,
+               confidence = 0.95, seed = None):
+    """ Approximately solves a tree by Monte Carlo tree search
+
+        args: tree, a LazyTree or a list of dictionary nodes
+              samples, number of search samples (default MCTS_SAMPLES without time_limit)
+              time_limit, seconds to search; the search stops at whichever limit comes first
+              rollouts, plays of the strategy found that estimate its value
+              exploration, weight of UCB1's exploration term, in units of the
+                           range of payoffs seen so far
+              confidence, level of the confidence interval, 0.95 for 95%
+              seed, seed for the random numbers
+        return: strategy, dictionary from each decision state the search reached to
+                          its most sampled descendant; play picks randomly at others
+                estimate, dictionary with
+                    'value', mean payoff of the rollouts of strategy
+                    'low', 'high', confidence interval of the strategy's expected value
+                    'stderr', standard error of 'value'
+                    'rollouts', number of rollouts
+                    'samples', number of search samples made
+                    'states', number of states sampled
+                    'search_value', mean payoff of the search samples at the root
+
+        The interval is for the strategy found, whose value is at most the value
+        of the optimal strategy that solve would find.
+    """
+    lazy = tree if isinstance(tree, LazyTree) else LazyTree.from_tree(tree)
+    rng = random.Random(seed)
+    if samples is None and time_limit is None:
+        samples = MCTS_SAMPLES
+    deadline = None if time_limit is None else time.perf_counter() + time_limit
+    root = lazy.root
+    visits = {}  # state -> number of samples that went through it
+    totals = {}  # state -> sum of their payoffs
+    low = high = None
+    rollout = RolloutPolicy(lazy, None, rng)
+    count = 0
+    while ((samples is None or count < samples)
+           and (deadline is None or time.perf_counter() < deadline)):
+        walk = []
+        state = root
+        while True:
+            walk.append(state)
+            node = lazy[state]
+            if node['type'] == 't':
+                payoff = float(node['pay'])
+                break
+            if state not in visits:
+                payoff = float(play(rollout, lazy, state, rng)[2])
+                break
+            if node['type'] == 'n':
+                if 'alias' not in node:
+                    node['alias'] = make_alias_table(node['probabilities'])
+                state = node['descendants'][sample_alias(node['alias'], rng)]
+            else:
+                scale = exploration * (high - low if high > low else 1.0)
+                state = choose_ucb(node['descendants'], visits, totals, visits[state], scale, rng)
+        for s in walk:
+            visits[s] = visits.get(s, 0) + 1
+            totals[s] = totals.get(s, 0.0) + payoff
+        if low is None or payoff < low:
+            low = payoff
+        if high is None or payoff > high:
+            high = payoff
+        count += 1
+
+    strategy = {}
+    for state in visits:
+        node = lazy[state]
+        if node['type'] == 'd':
+            sampled = [s for s in node['descendants'] if s in visits]
+            if sampled:
+                strategy[state] = max(sampled, key=lambda s: (visits[s], totals[s] / visits[s]))
+
+    estimate = {'samples': count, 'states': len(visits), 'rollouts': rollouts,
+                'search_value': totals[root] / visits[root] if visits else None,
+                'value': None, 'low': None, 'high': None, 'stderr': None}
+    if rollouts > 0:
+        policy = RolloutPolicy(lazy, strategy, rng)
+        pays = [float(play(policy, lazy, root, rng)[2]) for k in range(rollouts)]
+        mean = sum(pays) / rollouts
+        variance = sum((x - mean) ** 2 for x in pays) / (rollouts - 1) if rollouts > 1 else 0.0
+        stderr = math.sqrt(variance / rollouts)
+        z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+        estimate.update(value=mean, low=mean - z * stderr, high=mean + z * stderr, stderr=stderr)
+    return strategy, estimate
+
+
+#  A CompiledTree holds the same information as the list of dictionaries in flat
+#  arrays.  Children are stored CSR style: the descendants of node k are
+#  children[offsets[k]:offsets[k + 1]] and the matching probabilities are in
+#  probs[offsets[k]:offsets[k + 1]] (0.0 for the descendants of decision nodes).
+
+TYPE_CODES = {'t': 0, 'd': 1, 'n': 2}
+TYPE_NAMES = 'tdn'
+
+
+class CompiledTree:
+    """Array backed version of a tree used by the fast solvers.
+
+        names:    list of node names
+        types:    array of type codes (0 = terminal, 1 = decision, 2 = nature)
+        pay:      array of payoffs (0.0 for decision and nature nodes)
+        parent:   array of ancestor indexes (-1 for the root)
+        offsets:  array of len(tree) + 1 positions into children and probs
+        children: array of descendant node indexes
+        probs:    array of probabilities of reaching each descendant
+        subvalue: array of node values after solve or calc_values, else None
+    """
+
+    def __init__(self, names, types, pay, parent, offsets, children, probs):
+        self.names = names
+        self.types = types
+        self.pay = pay
+        self.parent = parent
+        self.offsets = offsets
+        self.children = children
+        self.probs = probs
+        self.subvalue = None
+        self._post_order = None
+        self._cumulative = None
+        self._levels = None
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getstate__(self):
+        # trees opened with open_binary hold views of a memory map, which
+        # cannot be pickled, so copy them into plain arrays
+        state = self.__dict__.copy()
+        for key, typecode in BINARY_SECTIONS:
+            if isinstance(state[key], memoryview):
+                state[key] = copy_buffer(typecode, state[key])
+        state['names'] = list(self.names)
+        return state
+
+    @classmethod
+    def from_tree(cls, tree):
+        """Compile a list of dictionary nodes"""
+        index = get_index(tree)
+        names = []
+        types = array('b')
+        pay = array('d')
+        probs = array('d')
+        for node in tree:
+            names.append(node['name'])
+            types.append(TYPE_CODES[node['type']])
+            if node['type'] == 't':
+                pay.append(float(node['pay']))
+            else:
+                pay.append(0.0)
+                if node['type'] == 'n':
+                    probs.extend(node['probabilities'])
+                else:
+                    probs.extend([0.0] * len(node['descendants']))
+        compiled = cls(names, types, pay, array('q', index.parent), array('q', index.offsets),
+                       array('q', index.children), probs)
+        compiled._post_order = array('q', index.post_order)
+        return compiled
+
+    def to_tree(self):
+        """Convert back to a list of dictionary nodes"""
+        tree = []
+        offsets = self.offsets
+        for k, code in enumerate(self.types):
+            node = {'name': self.names[k], 'type': TYPE_NAMES[code],
+                    'ancestor': int(self.parent[k]), 'filled': True}
+            if code == 0:
+                node['pay'] = self.pay[k]
+            else:
+                node['descendants'] = list(self.children[offsets[k]:offsets[k + 1]])
+                if code == 2:
+                    node['probabilities'] = list(self.probs[offsets[k]:offsets[k + 1]])
+            if self.subvalue is not None:
+                node['used'] = True
+                node['subvalue'] = self.subvalue[k]
+            tree.append(node)
+        return tree
+
+    def post_order(self):
+        """Node indexes ordered so every descendant comes before its ancestor"""
+        if self._post_order is not None:
+            return self._post_order
+        offsets = self.offsets
+        children = self.children
+        seen = bytearray(len(self.types))
+        order = array('q')
+        for root in range(len(self.types)):
+            if seen[root]:
+                continue
+            seen[root] = 1
+            stack = [root]
+            edge = [offsets[root]]
+            while stack:
+                k = stack[-1]
+                e = edge[-1]
+                if e < offsets[k + 1]:
+                    edge[-1] = e + 1
+                    j = children[e]
+                    if not seen[j]:
+                        seen[j] = 1
+                        stack.append(j)
+                        edge.append(offsets[j])
+                else:
+                    stack.pop()
+                    edge.pop()
+                    order.append(k)
+        self._post_order = order
+        return order
+
+    def solve(self):
+        """ Backward induction on the compiled tree, level by level with numpy
+            (see induct_levels) when it is available
+
+            return: strategy, a list of choices at decision nodes
+                    subvalue, a list with the value of every node
+        """
+        if np is not None:
+            values = np.frombuffer(self.pay, dtype=np.float64).copy()[None, :]
+            strategy = induct_levels(self, values, np.frombuffer(self.probs, dtype=np.float64)[None, :])
+            self.subvalue = copy_buffer('d', values[0])
+            return strategy[0].tolist(), values[0].tolist()
+        types = self.types
+        offsets = self.offsets
+        children = self.children
+        probs = self.probs
+        value = copy_buffer('d', self.pay)
+        strategy = [-1] * len(types)
+        for k in self.post_order():
+            code = types[k]
+            start = offsets[k]
+            end = offsets[k + 1]
+            if code == 0 or start == end:
+                continue
+            if code == 2:
+                v = 0.0
+                for e in range(start, end):
+                    v += value[children[e]] * probs[e]
+                value[k] = v
+            else:
+                choice = children[start]
+                v = value[choice]
+                for e in range(start + 1, end):
+                    j = children[e]
+                    if value[j] > v:
+                        v = value[j]
+                        choice = j
+                value[k] = v
+                strategy[k] = choice
+        self.subvalue = value
+        return strategy, value.tolist()
+
+    def calc_values(self, strategy):
+        """ Values of every node when strategy is played
+
+            return: subvalue, a list with the value of every node
+        """
+        if np is not None:
+            values = np.frombuffer(self.pay, dtype=np.float64).copy()[None, :]
+            induct_levels(self, values, np.frombuffer(self.probs, dtype=np.float64)[None, :],
+                          np.asarray(strategy, dtype=np.int64))
+            self.subvalue = copy_buffer('d', values[0])
+            return values[0].tolist()
+        types = self.types
+        offsets = self.offsets
+        children = self.children
+        probs = self.probs
+        value = copy_buffer('d', self.pay)
+        for k in self.post_order():
+            code = types[k]
+            if code == 2:
+                v = 0.0
+                for e in range(offsets[k], offsets[k + 1]):
+                    v += value[children[e]] * probs[e]
+                value[k] = v
+            elif code == 1:
+                value[k] = value[strategy[k]]
+        self.subvalue = value
+        return value.tolist()
+
+    def terminals(self):
+        """Indexes of the terminal nodes, the columns of pays in solve_scenarios"""
+        return [k for k, code in enumerate(self.types) if code == 0]
+
+    def nature_edges(self):
+        """ Positions in children and probs of the descendants of nature nodes,
+            the columns of probs in solve_scenarios"""
+        offsets = self.offsets
+        edges = []
+        for k, code in enumerate(self.types):
+            if code == 2:
+                edges.extend(range(offsets[k], offsets[k + 1]))
+        return edges
+
+    def levels(self):
+        """ Groups the decision and nature nodes by height above the terminals
+
+            return: list of (type code, nodes, edges, starts) with all nodes of one
+                    type and height.  edges lists the positions of their descendants
+                    in children and starts the position in edges of each node's first one.
+        """
+        if self._levels is not None:
+            return self._levels
+        if np is not None:
+            self._levels = self.levels_numpy()
+            return self._levels
+        types = self.types
+        offsets = self.offsets
+        children = self.children
+        height = [0] * len(types)
+        groups = {}
+        for k in self.post_order():
+            if types[k] == 0 or offsets[k] == offsets[k + 1]:
+                continue
+            h = 1 + max(height[children[e]] for e in range(offsets[k], offsets[k + 1]))
+            height[k] = h
+            groups.setdefault((h, types[k]), []).append(k)
+        levels = []
+        for h, code in sorted(groups):
+            nodes = sorted(groups[h, code])
+            edges = []
+            starts = []
+            for k in nodes:
+                starts.append(len(edges))
+                edges.extend(range(offsets[k], offsets[k + 1]))
+            levels.append((code, nodes, edges, starts))
+        self._levels = levels
+        return levels
+
+    def levels_numpy(self):
+        """ levels with numpy arrays in place of the lists.  The heights are found
+            from the terminals up, a whole height at a time: a node gets its
+            height once the last of its descendants has one
+        """
+        n = len(self.types)
+        types = np.frombuffer(self.types, dtype=np.int8)
+        offsets = np.frombuffer(self.offsets, dtype=np.int64)
+        children = np.frombuffer(self.children, dtype=np.int64)
+        counts = np.diff(offsets)
+        owner = np.repeat(np.arange(n), counts)  # the node each edge leaves
+        by_child = np.argsort(children, kind='stable')
+        child_starts = np.searchsorted(children[by_child], np.arange(n + 1))
+        remaining = counts.copy()
+        height = np.zeros(n, dtype=np.int64)
+        ready = np.flatnonzero(counts == 0)
+        h = 0
+        while ready.size:
+            h += 1
+            edges = by_child[ranges(child_starts[ready], child_starts[ready + 1])]
+            parents, done = np.unique(owner[edges], return_counts=True)
+            remaining[parents] -= done
+            ready = parents[remaining[parents] == 0]
+            height[ready] = h
+        nodes = np.flatnonzero(height)
+        nodes = nodes[np.lexsort((nodes, types[nodes], height[nodes]))]
+        keys = height[nodes] * 4 + types[nodes]
+        bounds = np.flatnonzero(np.diff(keys)) + 1
+        levels = []
+        for group in np.split(nodes, bounds):
+            sizes = counts[group]
+            starts = np.cumsum(sizes) - sizes
+            levels.append((int(types[group[0]]), group, ranges(offsets[group], offsets[group + 1]),
+                           starts))
+        return levels
+
+    def cumulative(self):
+        """Cumulative probabilities of each nature node scaled to end at exactly 1.0"""
+        if self._cumulative is not None:
+            return self._cumulative
+        offsets = self.offsets
+        probs = self.probs
+        cum = array('d', [0.0]) * len(probs)
+        for k, code in enumerate(self.types):
+            if code != 2:
+                continue
+            start = offsets[k]
+            end = offsets[k + 1]
+            total = 0.0
+            for e in range(start, end):
+                total += probs[e]
+                cum[e] = total
+            for e in range(start, end):
+                cum[e] = cum[e] / total
+        self._cumulative = cum
+        return cum
+
+    def play(self, strategy, cur_node = 0, rng = random):
+        """play the compiled tree using strategy while starting at cur_node"""
+        types = self.types
+        offsets = self.offsets
+        children = self.children
+        cum = self.cumulative()
+        while True:
+            code = types[cur_node]
+            if code == 0:
+                return [cur_node, self.names[cur_node], self.pay[cur_node]]
+            elif code == 1:
+                cur_node = strategy[cur_node]
+            else:
+                e = bisect.bisect_right(cum, rng.random(),
+                                        offsets[cur_node], offsets[cur_node + 1])
+                cur_node = children[e]
+
+
+def ranges(starts, ends):
+    """The numbers of every range(starts[k], ends[k]) in one numpy array"""
+    sizes = ends - starts
+    return np.arange(sizes.sum()) + np.repeat(starts - (np.cumsum(sizes) - sizes), sizes)
+
+
+def copy_buffer(typecode, buffer):
+    """Copies an array or memoryview into a new array without boxing every item"""
+    result = array(typecode)
+    result.frombytes(memoryview(buffer).cast('B'))
+    return result
+
+
+def compile_tree(tree):
+    """Returns a CompiledTree built from a list of dictionary nodes"""
+    return CompiledTree.from_tree(tree)
+
+
+#  Batched simulation.  Instead of playing one trial at a time, a whole vector
+#  of trials is moved down the tree one level per step using numpy.
+
+SIM_BATCH_SIZE = 100000
+
+
+def sim_counts_batched(num_trials, tree, strategy, batch_size = SIM_BATCH_SIZE, seed = None):
+    """ Simulates num_trials plays of strategy with numpy random draws
+
+        args: num_trials, number of plays of the tree
+              tree, a list of dictionary nodes or a CompiledTree
+              strategy, list of choices at decision nodes
+              batch_size, largest number of trials held in memory at once
+              seed, seed for numpy.random.default_rng
+        return: res, list with the number of trials ending at each node
+    """
+    if np is None:
+        raise ImportError('sim_counts_batched needs numpy')
+    if not isinstance(tree, CompiledTree):
+        tree = compile_tree(tree)
+    n = len(tree)
+    types = np.frombuffer(tree.types, dtype=np.int8)
+    offsets = np.frombuffer(tree.offsets, dtype=np.int64)
+    children = np.frombuffer(tree.children, dtype=np.int64)
+    cum = np.frombuffer(tree.cumulative(), dtype=np.float64)
+    choices = np.asarray(strategy, dtype=np.int64)
+    rng = np.random.default_rng(seed)
+
+    res = np.zeros(n, dtype=np.int64)
+    remaining = num_trials
+    while remaining > 0:
+        size = min(batch_size, remaining)
+        remaining -= size
+        active = np.zeros(size, dtype=np.int64)
+        while active.size:
+            codes = types[active]
+            done = codes == 0
+            res += np.bincount(active[done], minlength=n)
+            active = active[~done]
+            codes = codes[~done]
+
+            decision = codes == 1
+            active[decision] = choices[active[decision]]
+
+            # binary search each nature node's slice of cum for the drawn number
+            nature = np.flatnonzero(~decision)
+            nodes = active[nature]
+            draws = rng.random(nodes.size)
+            lo = offsets[nodes]
+            hi = offsets[nodes + 1] - 1
+            searching = lo < hi
+            while searching.any():
+                mid = (lo + hi) // 2
+                right = cum[mid] <= draws
+                lo = np.where(searching & right, mid + 1, lo)
+                hi = np.where(searching & ~right, mid, hi)
+                searching = lo < hi
+            active[nature] = children[lo]
+    return res.tolist()
+
+
+#  Parallel simulation.  The trials are split over a process pool and every
+#  worker draws from its own stream seeded from (seed, worker number), so the
+#  merged counts only depend on seed and the number of workers.
+
+def stream_seed(seed, stream):
+    """Derives the seed of random stream number stream from seed"""
+    digest = hashlib.sha256('{}/{}'.format(seed, stream).encode()).digest()
+    return int.from_bytes(digest[:8], 'little')
+
+
+def sim_counts_worker(num_trials, tree, strategy, seed, batch_size = None):
+    """ Used by sim_counts_parallel to run one share of the trials
+
+        args: tree, a CompiledTree
+        return: res, list with the number of trials ending at each node
+    """
+    if batch_size:
+        return sim_counts_batched(num_trials, tree, strategy, batch_size, seed)
+    rng = random.Random(seed)
+    res = [0] * len(tree)
+    for k in range(num_trials):
+        res[tree.play(strategy, 0, rng)[0]] += 1
+    return res
+
+
+def sim_counts_parallel(num_trials, tree, strategy, workers = None, seed = None, batch_size = None):
+    """ Simulates num_trials plays of strategy on a pool of processes
+
+        args: num_trials, number of plays of the tree
+              tree, a list of dictionary nodes or a CompiledTree
+              strategy, list of choices at decision nodes
+              workers, number of processes (default os.cpu_count())
+              seed, the same seed and workers give the same counts
+              batch_size, if given each worker uses sim_counts_batched
+        return: res, list with the number of trials ending at each node
+    """
+    if not isinstance(tree, CompiledTree):
+        tree = compile_tree(tree)
+    workers = workers or os.cpu_count() or 1
+    if seed is None:
+        seed = random.randrange(2 ** 63)
+    shares = [num_trials // workers + (1 if k < num_trials % workers else 0)
+              for k in range(workers)]
+    res = [0] * len(tree)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = [pool.submit(sim_counts_worker, share, tree, strategy,
+                            stream_seed(seed, k), batch_size)
+                for k, share in enumerate(shares) if share > 0]
+        for job in jobs:
+            for k, count in enumerate(job.result()):
+                res[k] += count
+    return res
+
+
+#  Scenario solving.  Backward induction is run for many sets of payoffs and
+#  probabilities at once: every row of a numpy matrix is one scenario and the
+#  nodes of equal height are handled together with reduceat.
+
+def solve_scenarios(tree, pays = None, probs = None):
+    """ Solves one tree structure for many alternative payoffs and probabilities
+
+        args: tree, a list of dictionary nodes or a CompiledTree
+              pays, matrix with one row of terminal payoffs per scenario, in the
+                    order of CompiledTree.terminals(); None keeps the tree's payoffs
+              probs, matrix with one row of nature probabilities per scenario, in
+                     the order of CompiledTree.nature_edges(); None keeps the tree's
+        return: values, array with the root value of each scenario
+                strategies, array with one strategy (list of choices) per scenario
+    """
+    if np is None:
+        raise ImportError('solve_scenarios needs numpy')
+    if not isinstance(tree, CompiledTree):
+        tree = compile_tree(tree)
+    pays = None if pays is None else np.atleast_2d(np.asarray(pays, dtype=np.float64))
+    probs = None if probs is None else np.atleast_2d(np.asarray(probs, dtype=np.float64))
+    if pays is not None and probs is not None and len(pays) != len(probs):
+        raise ValueError('pays has {} scenarios and probs has {}'.format(len(pays), len(probs)))
+    num_scenarios = len(pays) if pays is not None else (len(probs) if probs is not None else 1)
+
+    values = np.tile(np.frombuffer(tree.pay, dtype=np.float64), (num_scenarios, 1))
+    if pays is not None:
+        terminals = tree.terminals()
+        if pays.shape[1] != len(terminals):
+            raise ValueError('pays needs {} columns, one per terminal node'.format(len(terminals)))
+        values[:, terminals] = pays
+    # a single row of probabilities is shared by every scenario
+    edge_probs = np.frombuffer(tree.probs, dtype=np.float64)[None, :]
+    if probs is not None:
+        edges = tree.nature_edges()
+        if probs.shape[1] != len(edges):
+            raise ValueError('probs needs {} columns, one per nature descendant'.format(len(edges)))
+        edge_probs = np.tile(edge_probs, (num_scenarios, 1))
+        edge_probs[:, edges] = probs
+    strategies = induct_levels(tree, values, edge_probs)
+    return values[:, 0], strategies
+
+
+def induct_levels(tree, values, edge_probs, strategy = None):
+    """ Backward induction on a CompiledTree, one level of equal height at a time
+
+        args: tree, a CompiledTree
+              values, matrix with one row of node values per scenario holding the
+                      payoffs of the terminal nodes; the other nodes are filled in
+              edge_probs, matrix with one row of tree.probs per scenario, or a
+                          single row used by every scenario
+              strategy, None to choose the best descendant at decision nodes, else
+                        the choices to follow there (an array of node indexes)
+        return: strategies, array with one strategy per scenario, or None if
+                strategy was given
+    """
+    children = np.frombuffer(tree.children, dtype=np.int64)
+    strategies = None
+    if strategy is None:
+        strategies = np.full(values.shape, -1, dtype=np.int64)
+    for code, nodes, edges, starts in tree.levels():
+        if code == 1 and strategy is not None:
+            values[:, nodes] = values[:, strategy[nodes]]
+            continue
+        child_values = values[:, children[edges]]
+        starts = np.asarray(starts)
+        counts = np.diff(np.append(starts, len(edges)))
+        if code == 2:
+            # descendants are added one at a time in their order, like
+            # calc_expected_value, so values (and so ties) are exactly those of solve
+            weighted = child_values * edge_probs[:, edges]
+            total = weighted[:, starts]
+            for j in range(1, counts.max()):
+                more = counts > j
+                total[:, more] += weighted[:, starts[more] + j]
+            values[:, nodes] = total
+        else:
+            best = np.maximum.reduceat(child_values, starts, axis=1)
+            # the first descendant with the best value, like calc_max_value
+            position = np.where(child_values == np.repeat(best, counts, axis=1),
+                                np.arange(len(edges)), len(edges))
+            first = np.minimum.reduceat(position, starts, axis=1)
+            values[:, nodes] = best
+            strategies[:, nodes] = children[np.asarray(edges)[first]]
+    return strategies
 
 
 def edit(tree):
@@ -647,10 +3348,19 @@ def edit(tree):
                 inp = input('change payoff y/n')
                 if inp == 'y':
                     print("Enter New Payoff")
-                    node['pay'] = input('')
+                    node['pay'] = float(get_node_pay())
+                    mark_dirty(tree, index)
 
     if type_of_edit == 'prob':
-        pass
+        for index, node in enumerate(tree):
+            if node['type'] == 'n':
+                print("{} {} has probabilities {}".format(index, node['name'], node['probabilities']))
+                inp = input('change probabilities y/n')
+                if inp == 'y':
+                    node['probabilities'] = get_node_probabilities(node['descendants'])
+                    node.pop('alias', None)
+                    mark_dirty(tree, index)
+        build_samplers(tree)
 
     if type_of_edit == 'name':
         for index, node in enumerate(tree):
@@ -674,7 +3384,8 @@ def process_loop():
                  'find': True, 'load': True, 'save': True,
                  'play': True, 'exit': True, 'edit': True,
                  'path': True, 'sim': True, 'help': True,
-                 'solve': True, 'calc': True, 'see': True}
+                 'solve': True, 'calc': True, 'see': True,
+                 'exact': True, 'stats': True, 'evpi': True}
 
     tree = []
     strategy = []
@@ -702,13 +3413,24 @@ def process_loop():
                 oc = play(strategy, tree)
                 print('oc = {}'.format(oc))
         elif choice == 'sim':
-            payoffs, ev = sim_decisions(1000000, tree, strategy)
+            payoffs, ev = sim_decisions(1000000, tree, strategy,
+                                        SIM_BATCH_SIZE if np is not None else None)
             print(payoffs)
             print('Expected value = {}'.format(ev))
             obs = sim(strategy, tree)
             print(obs)
+        elif choice == 'exact':
+            show_distribution(strategy, tree)
+        elif choice == 'evpi':
+            show_evpi(tree)
+        elif choice == 'stats':
+            if STATS is None:
+                enable_stats()
+                print('Statistics are now recorded.  Type stats again to see them.')
+            else:
+                STATS.report()
         elif choice == 'solve':
-            strategy, tree = solve(tree)
+            strategy, tree = resolve(tree)
             print(strategy)
             print('ev = ' + str(tree[0]['subvalue']))
         elif choice == 'calc':
@@ -726,5 +3448,116 @@ def process_loop():
             return
 
 
+#  Batch mode.  Running this file with a command and tree files, e.g.
+#
+#      python decision_tree.py solve 'trees/*.txt' --out results.jsonl --workers 8
+#
+#  processes every file on a pool of processes and appends one JSON object per
+#  file to the output.  Files that already have a result in the output are
+#  skipped, so an interrupted run can be started again with the same command.
+#  Without a command the interactive menu (process_loop) is run.
+
+BATCH_COMMANDS = ('solve', 'calc', 'sim', 'path')
+
+
+def batch_job(command, file_name, strategy = None, trials = 100000, seed = None, cache = None):
+    """ Used by main to run one command on one tree file
+
+        cache is the directory of a SolveCache shared by all the jobs, or None
+        return: dictionary with the results, ready to be written as JSON
+    """
+    start = time.perf_counter()
+    result = {'file': file_name, 'command': command}
+    if cache is not None and (SOLVE_CACHE is None or SOLVE_CACHE.directory != cache):
+        enable_cache(cache)
+    try:
+        tree = load_tree(file_name)
+        if strategy is None or command == 'solve':
+            strategy, tree = solve(tree)
+        else:
+            tree = calc_values(strategy, tree)
+        result['ev'] = tree[0]['subvalue']
+        result['strategy'] = strategy
+        if command == 'sim':
+            file_seed = stream_seed(seed, file_name) if seed is not None else None
+            if np is not None:
+                res = sim_counts_batched(trials, tree, strategy, SIM_BATCH_SIZE, file_seed)
+            else:
+                res = compile_tree(tree)
+                rng = random.Random(file_seed)
+                counts = [0] * len(tree)
+                for k in range(trials):
+                    counts[res.play(strategy, 0, rng)[0]] += 1
+                res = counts
+            result['trials'] = trials
+            result['histogram'] = {str(k): count for k, count in enumerate(res) if count}
+            result['sim_ev'] = sum(count * float(tree[k]['pay'])
+                                   for k, count in enumerate(res) if count) / trials
+        elif command == 'path':
+            text = io.StringIO()
+            path(strategy, tree, file=text)
+            result['path'] = text.getvalue()
+    except Exception as error:  # one bad file must not stop the batch
+        result['error'] = '{}: {}'.format(type(error).__name__, error)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def finished_files(out_name, command):
+    """Files that already have a result (without an error) for command in out_name"""
+    done = set()
+    if out_name is None or not os.path.exists(out_name):
+        return done
+    with open(out_name) as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # a line cut short when a run was interrupted
+            if result.get('command') == command and 'error' not in result:
+                done.add(result['file'])
+    return done
+
+
+def main(argv = None):
+    """Runs the batch mode if a command is given, otherwise the interactive menu"""
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv:
+        process_loop()
+        return
+    parser = argparse.ArgumentParser(description='Solve and simulate decision tree files.')
+    parser.add_argument('command', choices=BATCH_COMMANDS)
+    parser.add_argument('files', nargs='+', help='tree files (.txt or .dtb) or glob patterns')
+    parser.add_argument('--out', help='JSON lines file to append results to (default stdout)')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes')
+    parser.add_argument('--strategy', help='strategy as a JSON list (default the optimal one)')
+    parser.add_argument('--trials', type=int, default=100000, help='plays per file for sim')
+    parser.add_argument('--seed', type=int, default=None, help='seed for reproducible sim')
+    parser.add_argument('--cache', help='directory of a solve cache kept between runs')
+    args = parser.parse_args(argv)
+
+    files = []
+    for pattern in args.files:
+        matches = sorted(glob.glob(pattern))
+        files.extend(matches if matches else [pattern])
+    done = finished_files(args.out, args.command)
+    files = [f for f in dict.fromkeys(files) if f not in done]
+    strategy = json.loads(args.strategy) if args.strategy else None
+
+    out = open(args.out, 'a') if args.out else sys.stdout
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            jobs = [pool.submit(batch_job, args.command, f, strategy, args.trials, args.seed,
+                                args.cache)
+                    for f in files]
+            for job in as_completed(jobs):
+                out.write(json.dumps(job.result()) + '\n')
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
 if __name__ == '__main__':
-    process_loop()
+    main()
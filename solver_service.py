@@ -0,0 +1,334 @@
+"""
+A local service that keeps decision trees loaded and answers queries about them.
+
+    python solver_service.py --port 8765 trees/*.txt
+    python solver_service.py --unix /tmp/decision_tree.sock
+
+Requests are HTTP with a JSON body (or none), answers are JSON:
+
+    GET  /trees                                     names and sizes of the loaded trees
+    GET  /stats                                     time spent per request and per phase
+    POST /load   {"name": n, "file": f}             load a .txt or .dtb file (.txt may be left off)
+    POST /load   {"name": n, "text": t}             load a tree from text written by save_tree
+    POST /unload {"tree": n}
+    POST /solve  {"tree": n}                        optimal strategy and ev
+    POST /calc   {"tree": n, "strategy": s}         ev of strategy s
+    POST /path   {"tree": n, "strategy": s}         path text (s defaults to the optimal one)
+    POST /sim    {"tree": n, "strategy": s, "trials": 100000, "seed": 1}
+
+solve, calc and path use the functions of decision_tree on the loaded tree, so
+they answer exactly what the interactive tool would.  They run on the event
+loop; a solved tree is kept solved (see decision_tree.resolve), so repeated
+solves are cheap.  Loading and simulation are CPU heavy and are run on a
+process pool so the service keeps answering while they work.
+
+Each worker of the pool keeps the CompiledTree of the trees it has simulated,
+so a /sim request sends only the tree's name and version, the strategy and
+the seed.  A worker that does not have the tree answers None and the request
+is sent again with the tree, which the worker then keeps.
+"""
+
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import decision_tree as dt
+
+
+MAX_BODY = 256 << 20  # largest request body accepted, in bytes
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class RequestError(Exception):
+    """An error caused by the request, answered with status and a message"""
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def load_text(text):
+    """Used by the pool to parse a tree sent as text"""
+    return dt.load_tree(io.StringIO(text))
+
+
+RESIDENT = {}  # in a worker of the pool, name to (version, CompiledTree) of the trees sent to it
+
+
+def sim_counts(name, version, live, compiled, num_trials, strategy, seed):
+    """ Used by the pool to simulate on the CompiledTree of tree name
+
+        version:  the version of the tree the request is about
+        live:     dictionary of name to version of every loaded tree, the other
+                  trees kept by the worker are dropped
+        compiled: the CompiledTree, or None to use the one kept by the worker
+        return:   counts of trials ending at each node, or None if the worker
+                  does not have this version of the tree
+    """
+    for other in [other for other in RESIDENT if live.get(other) != RESIDENT[other][0]]:
+        del RESIDENT[other]
+    if compiled is not None:
+        RESIDENT[name] = version, compiled
+    elif name not in RESIDENT:
+        return None
+    batch_size = dt.SIM_BATCH_SIZE if dt.np is not None else None
+    return dt.sim_counts_worker(num_trials, RESIDENT[name][1], strategy, seed, batch_size)
+
+
+class SolverService:
+    """ Loaded trees and the handlers of the requests about them
+
+        trees:    dictionary of name to tree (a list of dictionary nodes)
+        versions: dictionary of name to a number that changes whenever the name is loaded
+        compiled: dictionary of name to the CompiledTree sent to the pool by sim
+        stats:    decision_tree.Stats with the time of every request by route
+    """
+
+    def __init__(self, workers = None):
+        self.trees = {}
+        self.versions = {}
+        self.next_version = itertools.count()
+        self.compiled = {}
+        # forked workers would keep copies of the open sockets, so a closed
+        # connection would not reach the client until every worker exits
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(
+            'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'))
+        self.stats = dt.Stats()
+        self.routes = {('GET', '/trees'): self.list_trees,
+                       ('GET', '/stats'): self.get_stats,
+                       ('POST', '/load'): self.load,
+                       ('POST', '/unload'): self.unload,
+                       ('POST', '/solve'): self.solve,
+                       ('POST', '/calc'): self.calc,
+                       ('POST', '/path'): self.path,
+                       ('POST', '/sim'): self.sim}
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    def get_tree(self, request):
+        name = request.get('tree')
+        if name not in self.trees:
+            raise RequestError(404, 'no tree named {!r} is loaded'.format(name))
+        return name, self.trees[name]
+
+    def get_strategy(self, request, tree):
+        """The strategy of the request, or the optimal one if it has none"""
+        strategy = request.get('strategy')
+        if strategy is None:
+            return dt.resolve(tree)[0]
+        if not isinstance(strategy, list) or len(strategy) != len(tree):
+            raise RequestError(400, 'strategy must be a list with one entry per node')
+        for k, node in enumerate(tree):
+            if node['type'] == 'd' and strategy[k] not in node['descendants']:
+                raise RequestError(400, 'strategy picks {!r} at node {}'.format(strategy[k], k))
+        return strategy
+
+    async def list_trees(self, request):
+        return {'trees': {name: len(tree) for name, tree in self.trees.items()}}
+
+    async def get_stats(self, request):
+        return {'requests': self.stats.as_dict(),
+                'phases': dt.STATS.as_dict() if dt.STATS is not None else {}}
+
+    async def load(self, request):
+        name = request.get('name')
+        if not isinstance(name, str) or not name:
+            raise RequestError(400, 'load needs a name')
+        loop = asyncio.get_running_loop()
+        if 'text' in request:
+            tree = await loop.run_in_executor(self.pool, load_text, request['text'])
+        elif 'file' in request:
+            file_name = request['file']
+            if not os.path.isfile(file_name):  # a name without .txt, as in the menu
+                file_name = dt.tree_file_name(file_name)
+            if not os.path.isfile(file_name):
+                raise RequestError(404, 'file {} does not exist'.format(request['file']))
+            tree = await loop.run_in_executor(self.pool, dt.load_tree, file_name)
+        else:
+            raise RequestError(400, 'load needs a file or text')
+        if not tree:
+            raise RequestError(400, 'the tree has no nodes')
+        self.add_tree(name, tree)
+        return {'tree': name, 'nodes': len(tree)}
+
+    def add_tree(self, name, tree):
+        """Loads tree under name, replacing the tree of that name in the service and its workers"""
+        self.trees[name] = tree
+        self.versions[name] = next(self.next_version)
+        self.compiled.pop(name, None)
+
+    async def unload(self, request):
+        name, tree = self.get_tree(request)
+        del self.trees[name]
+        del self.versions[name]
+        self.compiled.pop(name, None)
+        return {'tree': name}
+
+    async def solve(self, request):
+        name, tree = self.get_tree(request)
+        strategy, tree = dt.resolve(tree)
+        return {'tree': name, 'ev': tree[0]['subvalue'], 'strategy': strategy}
+
+    async def calc(self, request):
+        name, tree = self.get_tree(request)
+        if request.get('strategy') is None:
+            raise RequestError(400, 'calc needs a strategy')
+        strategy = self.get_strategy(request, tree)
+        tree = dt.calc_values(strategy, tree)
+        return {'tree': name, 'ev': tree[0]['subvalue'], 'strategy': strategy}
+
+    async def path(self, request):
+        name, tree = self.get_tree(request)
+        strategy = self.get_strategy(request, tree)
+        text = io.StringIO()
+        dt.path(strategy, tree, file=text)
+        return {'tree': name, 'path': text.getvalue()}
+
+    async def sim(self, request):
+        name, tree = self.get_tree(request)
+        strategy = self.get_strategy(request, tree)
+        trials = request.get('trials', 100000)
+        if not isinstance(trials, int) or trials <= 0:
+            raise RequestError(400, 'trials must be a positive integer')
+        version = self.versions[name]
+        live = dict(self.versions)  # pickled by the pool later, the loaded trees may change by then
+        loop = asyncio.get_running_loop()
+        res = await loop.run_in_executor(self.pool, sim_counts, name, version, live,
+                                         None, trials, strategy, request.get('seed'))
+        if res is None:  # the worker does not have the tree yet
+            if name not in self.compiled:
+                self.compiled[name] = dt.compile_tree(tree)
+            res = await loop.run_in_executor(self.pool, sim_counts, name, version, live,
+                                             self.compiled[name], trials, strategy,
+                                             request.get('seed'))
+        return {'tree': name, 'trials': trials,
+                'histogram': {str(k): int(count) for k, count in enumerate(res) if count},
+                'sim_ev': sum(count * float(tree[k]['pay'])
+                              for k, count in enumerate(res) if count) / trials}
+
+    async def answer(self, method, target, body):
+        """ Runs the handler of one request
+
+            return: (status, dictionary to send as JSON)
+        """
+        start = time.perf_counter()
+        route = target.split('?', 1)[0]
+        handler = self.routes.get((method, route))
+        try:
+            if handler is None:
+                if any(path == route for m, path in self.routes):
+                    raise RequestError(405, '{} is not allowed on {}'.format(method, route))
+                raise RequestError(404, 'no such route {}'.format(route))
+            try:
+                request = json.loads(body) if body.strip() else {}
+            except ValueError as error:
+                raise RequestError(400, 'body is not JSON: {}'.format(error))
+            if not isinstance(request, dict):
+                raise RequestError(400, 'body must be a JSON object')
+            status, result = 200, await handler(request)
+        except RequestError as error:
+            status, result = error.status, {'error': str(error)}
+        except dt.TreeValidationError as error:
+            status, result = 400, {'error': str(error), 'problems': error.problems}
+        except Exception as error:  # a bad tree must not stop the service
+            status, result = 500, {'error': '{}: {}'.format(type(error).__name__, error)}
+        seconds = time.perf_counter() - start
+        self.stats.record(route if handler is not None else 'other', seconds, errors=int(status != 200))
+        result['seconds'] = seconds
+        print('{} {} {} {:.4f} s'.format(method, route, status, seconds), file=sys.stderr)
+        return status, result
+
+    async def handle(self, reader, writer):
+        """Answers the HTTP requests of one connection until it is closed"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0) or 0)
+                if length > MAX_BODY:
+                    status, result = 413, {'error': 'request body is too large'}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    status, result = await self.answer(method, target, body)
+                    connection = headers.get('connection', '').lower()
+                    keep_alive = (connection != 'close' if version == 'HTTP/1.1'
+                                  else connection == 'keep-alive')
+                data = json.dumps(result).encode()
+                writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n'
+                             'Content-Length: {}\r\nConnection: {}\r\n\r\n'
+                             .format(status, REASONS[status], len(data),
+                                     'keep-alive' if keep_alive else 'close').encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(service, host = '127.0.0.1', port = 8765, unix = None):
+    """Runs service until it is cancelled"""
+    if unix is not None:
+        server = await asyncio.start_unix_server(service.handle, unix)
+        where = unix
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+        where = 'http://{}:{}'.format(host, port)
+    print('decision tree service listening on {}'.format(where), file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Serve decision trees kept in memory.')
+    parser.add_argument('files', nargs='*', help='tree files to load at start, named by file name')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--workers', type=int, default=None, help='processes for load and sim')
+    parser.add_argument('--cache', help='directory of a solve cache, see decision_tree.enable_cache')
+    parser.add_argument('--stats', action='store_true',
+                        help='record decision_tree statistics, shown by GET /stats')
+    args = parser.parse_args(argv)
+
+    if args.cache:
+        dt.enable_cache(args.cache)
+    if args.stats:
+        dt.enable_stats()
+    service = SolverService(args.workers)
+    for file_name in args.files:
+        service.add_tree(os.path.basename(file_name), dt.load_tree(file_name))
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+import copy
+import io
+import itertools
+import math
+import os
+import random
+
+import pytest
+
+import decision_tree as dt
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_example(name):
+    return dt.load_tree(os.path.join(HERE, name))
+
+
+def test_solve_lazy_twice_returns_the_whole_strategy():
+    strategy, tree = dt.solve(load_example('big_tree.txt'))
+    lazy = dt.LazyTree.from_tree(tree)
+    first = dt.solve_lazy(lazy)
+    second = dt.solve_lazy(lazy)
+    assert first == second
+    assert first[0] == {k: strategy[k] for k, node in enumerate(tree) if node['type'] == 'd'}
+    text = io.StringIO()
+    dt.path(second[0], lazy, lazy.root, file=text)
+    assert text.getvalue()
+
+
+def test_solve_lazy_after_solving_a_subtree():
+    strategy, tree = dt.solve(load_example('big_tree.txt'))
+    lazy = dt.LazyTree.from_tree(tree)
+    dt.solve_lazy(lazy, 5)
+    lazy_strategy, value = dt.solve_lazy(lazy)
+    assert sorted(lazy_strategy) == [k for k, node in enumerate(tree) if node['type'] == 'd']
+    assert value == tree[0]['subvalue']
+
+
+def test_load_empty_file():
+    assert dt.load_tree(io.StringIO('')) == []
+
+
+def test_value_of_information_after_an_edit():
+    strategy, tree = dt.solve(load_example('big_tree.txt'))
+    nature = [k for k, node in enumerate(tree) if node['type'] == 'n']
+    for k, node in enumerate(tree):
+        if node['type'] == 't':
+            node['pay'] = float(node['pay']) + 7 * k
+            dt.mark_dirty(tree, k)
+    voi = dt.value_of_information(tree, nature[0])
+    fresh = dt.solve(tree)[1]
+    assert voi['base'] == fresh[0]['subvalue']
+
+
+def all_strategies(tree):
+    decisions = [k for k, node in enumerate(tree) if node['type'] == 'd']
+    for choices in itertools.product(*[tree[k]['descendants'] for k in decisions]):
+        strategy = [-1] * len(tree)
+        for k, choice in zip(decisions, choices):
+            strategy[k] = choice
+        yield strategy
+
+
+def tail_mean(distribution, alpha):
+    """Mean of the worst alpha share of a payoff distribution"""
+    mass = total = 0.0
+    for pay, p in distribution:
+        take = min(p, alpha - mass)
+        if take <= 0.0:
+            break
+        mass += take
+        total += pay * take
+    return total / mass
+
+
+@pytest.mark.parametrize('numpy', [True, False])
+def test_cvar_matches_brute_force(numpy, monkeypatch):
+    if not numpy:
+        monkeypatch.setattr(dt, 'np', None)
+    elif dt.np is None:
+        pytest.skip('needs numpy')
+    for seed in range(40):
+        alpha = (0.05, 0.2, 0.5, 1.0)[seed % 4]
+        tree = dt.random_tree(25, 2 + seed % 2, seed=seed)
+        strategy, tree = dt.solve(tree, dt.CVaR(alpha))
+        got = tail_mean(dt.payoff_distribution(strategy, tree), alpha)
+        best = max(tail_mean(dt.payoff_distribution(s, tree), alpha) for s in all_strategies(tree))
+        assert got == pytest.approx(best)
+        assert tree[0]['subvalue'] == pytest.approx(got)
+
+
+def test_cvar_search_matches_every_eta():
+    if dt.np is None:
+        pytest.skip('needs numpy')
+    for seed, alpha in enumerate((0.01, 0.1, 0.5)):
+        tree = dt.random_tree(2000, 3, seed=seed)
+        objective = dt.CVaR(alpha)
+        etas = sorted(set(node['pay'] for node in tree if node['type'] == 't'))
+        every = max(dt.cvar_values(tree, dt.compile_tree(tree), objective, etas))
+        assert dt.solve(tree, objective)[1][0]['subvalue'] == pytest.approx(every)
+
+
+def test_expected_utility_matches_brute_force():
+    objective = dt.ExpectedUtility(math.sqrt, lambda u: u * u)
+    for seed in range(20):
+        tree = dt.random_tree(25, 2, seed=seed)
+        strategy, tree = dt.solve(tree, objective)
+
+        def utility(s):
+            return sum(p * math.sqrt(pay) for pay, p in dt.payoff_distribution(s, tree))
+        best = max(utility(s) for s in all_strategies(tree))
+        assert utility(strategy) == pytest.approx(best)
+        assert tree[0]['subvalue'] == pytest.approx(best * best)
+
+
+@pytest.mark.parametrize('numpy', [True, False])
+def test_compiled_tree_matches_solve(numpy, monkeypatch):
+    if not numpy:
+        monkeypatch.setattr(dt, 'np', None)
+    elif dt.np is None:
+        pytest.skip('needs numpy')
+    for seed in range(10):
+        strategy, tree = dt.solve(dt.random_tree(400, 2 + seed % 3, seed=seed))
+        compiled = dt.compile_tree(tree)
+        compiled_strategy, values = compiled.solve()
+        assert compiled_strategy == strategy
+        assert values == pytest.approx([node['subvalue'] for node in tree])
+        other = [node['descendants'][-1] if node['type'] == 'd' else -1 for node in tree]
+        values = compiled.calc_values(other)
+        assert values == pytest.approx([node['subvalue'] for node in dt.calc_values(other, tree)])
+
+
+def test_expand_tree_restores_the_deduped_tree():
+    for tree in (load_example('big_tree.txt'), dt.random_tree(3000, 2, seed=3)):
+        dag, mapping, names = dt.dedupe_tree(tree)
+        assert len(dag) < len(tree)
+        original = io.StringIO()
+        dt.write_tree(tree, original)
+        expanded = io.StringIO()
+        dt.write_tree(dt.expand_tree(dag, names=names)[1], expanded)
+        assert expanded.getvalue() == original.getvalue()
+
+
+@pytest.mark.parametrize('text, problem', [
+    ('node,0\nname,a\ntype,t\npay,abc\n', (0, "line 4: pay 'abc' is not a number")),
+    ('name,a\nnode,0\nname,a\ntype,t\npay,1\n', (-1, 'line 1: name comes before the first node line')),
+    ('node,0\nname,a\ndescendant,1\ntype,t\npay,1\n',
+     (0, 'line 3: descendant comes before the type of the node')),
+    ('node,0\nname,a\ntype,t\npay,1\ndescendant,1\n', (0, "line 5: a node of type 't' has no descendant lines")),
+])
+@pytest.mark.parametrize('compact', [False, True])
+def test_load_reports_lines_it_can_not_read(text, problem, compact):
+    with pytest.raises(dt.TreeValidationError) as error:
+        dt.load_tree(io.StringIO(text), compact=compact, validate=False)
+    assert error.value.problems == [problem]
+
+
+def set_key(k, key, value):
+    def change(tree):
+        tree[k][key] = value
+    return change
+
+
+@pytest.mark.parametrize('change, problem', [
+    (set_key(2, 'probabilities', [0.5, 0.6]), (2, 'probabilities sum to 1.1')),
+    (set_key(2, 'descendants', [3, 7]), (2, 'descendant 7 is not a node of the tree')),
+    (set_key(2, 'descendants', [3, 0]), (2, 'is on a cycle or below one')),
+    (set_key(0, 'descendants', []), (0, 'decision node has no descendants')),
+    (set_key(3, 'pay', 'abc'), (3, "pay 'abc' is not a number")),
+])
+def test_validate_tree_reports_the_broken_node(change, problem):
+    tree = load_example('sure_or_flip.txt')
+    assert dt.validate_tree(tree) == []
+    change(tree)
+    assert problem in dt.validate_tree(tree)
+    with pytest.raises(dt.TreeValidationError) as error:
+        dt.check_tree(tree)
+    assert problem in error.value.problems
+
+
+def test_solve_validates_again_after_the_structure_changes():
+    tree = load_example('sure_or_flip.txt')
+    dt.solve(tree)
+    tree[0]['descendants'] = [2]
+    with pytest.raises(dt.TreeValidationError) as error:
+        dt.solve(tree)
+    assert error.value.problems == [(1, 'can not be reached from node 0')]
+    tree[0]['descendants'] = [2, 1]
+    assert dt.solve(tree)[0][0] == 2
+    assert list(dt.get_index(tree).parent) == [-1, 0, 0, 2, 2]
+
+
+def test_resolve_matches_a_fresh_solve():
+    for seed in range(40):
+        rng = random.Random(seed)
+        strategy, tree = dt.solve(dt.random_tree(200, 2 + seed % 3, seed=seed))
+        terminals = [k for k, node in enumerate(tree) if node['type'] == 't']
+        nature = [k for k, node in enumerate(tree) if node['type'] == 'n']
+        for edit in range(5):
+            for k in rng.sample(terminals, 3):
+                tree[k]['pay'] = round(rng.uniform(0.0, 100.0), 2)
+                dt.mark_dirty(tree, k)
+            for k in rng.sample(nature, min(2, len(nature))):
+                weights = [rng.random() for j in tree[k]['descendants']]
+                tree[k]['probabilities'] = [w / sum(weights) for w in weights]
+                dt.mark_dirty(tree, k)
+            strategy, tree = dt.resolve(tree)
+            fresh_strategy, fresh = dt.solve(copy.deepcopy(tree))
+            assert strategy == fresh_strategy
+            assert [node['subvalue'] for node in tree] == pytest.approx([node['subvalue'] for node in fresh])
+
+
+def quarters(rng, count):
+    """Probabilities in quarters, so sums are exact and ties stay ties"""
+    probs = [0.0] * count
+    for j in range(4):
+        probs[rng.randrange(count)] += 0.25
+    return probs
+
+
+@pytest.mark.parametrize('edit', ['pays', 'probs'])
+def test_solve_scenarios_matches_solve(edit):
+    if dt.np is None:
+        pytest.skip('needs numpy')
+    rng = random.Random(edit)
+    for seed in range(10):
+        tree = dt.random_tree(150, 2 + seed % 3, seed=seed)
+        for node in tree:  # few distinct payoffs, so decisions have ties
+            if node['type'] == 't':
+                node['pay'] = float(rng.randrange(4))
+        compiled = dt.compile_tree(tree)
+        terminals = compiled.terminals()
+        nature = [k for k, node in enumerate(tree) if node['type'] == 'n']
+        rows = []
+        for s in range(8):
+            if edit == 'pays':
+                rows.append([float(rng.randrange(4)) for k in terminals])
+            else:
+                rows.append([p for k in nature for p in quarters(rng, len(tree[k]['descendants']))])
+        values, strategies = dt.solve_scenarios(compiled, **{edit: rows})
+        for s, row in enumerate(rows):
+            scenario = copy.deepcopy(tree)
+            if edit == 'pays':
+                for k, pay in zip(terminals, row):
+                    scenario[k]['pay'] = pay
+            else:
+                position = 0
+                for k in nature:
+                    count = len(scenario[k]['descendants'])
+                    scenario[k]['probabilities'] = row[position:position + count]
+                    position += count
+            strategy, scenario = dt.solve(scenario)
+            assert list(strategies[s]) == strategy
+            assert values[s] == scenario[0]['subvalue']